@@ -6,33 +6,58 @@ import re
 import os
 import sys
 import time
+import codecs
 import logging
 import marshal
 import tempfile
 import threading
+import weakref
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
 from math import log
 from hashlib import md5
 from ._compat import *
 from . import finalseg
+from . import scanner
+from .scanner import BLOCK, SEP
+from .compiled import CompiledDict, COMPILED_SUFFIX, is_compiled
+from .prefixdict import LayeredDict, PrefixDict, TrieTable
+from .segcache import BlockCache, ResultCache
 
 if os.name == 'nt':
     from shutil import move as _replace_file
 else:
     _replace_file = os.rename
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 _get_abs_path = lambda path: os.path.normpath(os.path.join(os.getcwd(), path))
 
 DEFAULT_DICT = None
 DEFAULT_DICT_NAME = "dict.txt"
 
+# directory of the prefix dict caches when Tokenizer.tmp_dir is not set,
+# the system temp directory by default
+CACHE_DIR = os.environ.get("JIEBA_CACHE_DIR")
+
 log_console = logging.StreamHandler(sys.stderr)
 default_logger = logging.getLogger(__name__)
 default_logger.setLevel(logging.DEBUG)
 default_logger.addHandler(log_console)
 
 DICT_WRITING = {}
+# the SharedDict of every (content hash, compact) dictionary in use
+SHARED_DICTS = weakref.WeakValueDictionary()
+INIT_FUTURE_LOCK = threading.Lock()
 
 pool = None
+# the ParallelTokenizer of jieba.posseg.dt, started on demand while parallel
+pos_pool = None
 
 re_userdict = re.compile('^(.+?)( [0-9]+)?( [a-z]+)?$', re.U)
 
@@ -40,54 +65,638 @@ re_eng = re.compile('[a-zA-Z0-9]', re.U)
 
 # \u4E00-\u9FD5a-zA-Z0-9+#&\._ : All non-space characters. Will be handled with re_han
 # \r\n|\s : whitespace characters. Will not be handled.
-re_han_default = re.compile("([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)", re.U)
-re_skip_default = re.compile("(\r\n|\s)", re.U)
-re_han_cut_all = re.compile("([\u4E00-\u9FD5]+)", re.U)
-re_skip_cut_all = re.compile("[^a-zA-Z0-9+#\n]", re.U)
+# Segmentation splits blocks with jieba.scanner, these are kept for the
+# code using them.
+re_han_default = re.compile(r"([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)", re.U)
+re_skip_default = re.compile(r"(\r\n|\s)", re.U)
+re_han_cut_all = re.compile(r"([\u4E00-\u9FD5]+)", re.U)
+re_skip_cut_all = re.compile(r"[^a-zA-Z0-9+#\n]", re.U)
+# a single character of a re_han_default / re_han_cut_all block
+re_han_char = re.compile(r"[\u4E00-\u9FD5a-zA-Z0-9+#&\._]", re.U)
+re_han_char_cut_all = re.compile("[\u4E00-\u9FD5]", re.U)
 
 def setLogLevel(log_level):
     global logger
     default_logger.setLevel(log_level)
 
+
+def _common_prefix(a, b, step=4096):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + step] == b[i:i + step]:
+        i += step
+    n = min(n, i + step)
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, b, limit, step=4096):
+    la = len(a)
+    lb = len(b)
+    i = 0
+    while i + step <= limit and \
+            a[la - i - step:la - i] == b[lb - i - step:lb - i]:
+        i += step
+    while i < limit and a[la - i - 1] == b[lb - i - 1]:
+        i += 1
+    return i
+
+
+def _is_boundary(sentence, i):
+    """Whether default-mode words can never span position i of sentence."""
+    if i <= 0 or i >= len(sentence):
+        return True
+    a = sentence[i - 1]
+    b = sentence[i]
+    if a == '\r' and b == '\n':
+        return False
+    return not (re_han_char.match(a) and re_han_char.match(b))
+
+
+def _is_boundary_cut_all(sentence, i):
+    """Whether full-mode words can never span position i of sentence."""
+    if i <= 0 or i >= len(sentence):
+        return True
+    a = re_han_char_cut_all.match(sentence[i - 1])
+    b = re_han_char_cut_all.match(sentence[i])
+    return bool(a) != bool(b)
+
+
+def _read_chunks(f, size):
+    while True:
+        data = f.read(size)
+        if not data:
+            break
+        yield data
+
+
+def _stream_chunks(source, chunk_chars, is_boundary=_is_boundary):
+    """
+    Regroup a file object or an iterable of str/utf-8 bytes into pieces of
+    about `chunk_chars` characters that end where `is_boundary` allows, so
+    cutting them one by one gives the same words as cutting the whole text.
+    """
+    if hasattr(source, 'read'):
+        source = _read_chunks(source, chunk_chars)
+    decoder = None
+    buf = ''
+    # positions below `checked` are known not to be boundaries
+    checked = 1
+    for data in source:
+        if not isinstance(data, text_type):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            data = decoder.decode(data)
+        buf += data
+        if len(buf) < chunk_chars:
+            continue
+        i = len(buf) - 1
+        while i >= checked and not is_boundary(buf, i):
+            i -= 1
+        if i >= checked:
+            yield buf[:i]
+            buf = buf[i:]
+            checked = 1
+        else:
+            checked = len(buf)
+    if decoder is not None:
+        buf += decoder.decode(b'', True)
+    if buf:
+        yield buf
+
+
+def _span_index(spans, pos):
+    """Index in flat `spans` of the first word starting at or after pos."""
+    lo = 0
+    hi = len(spans) // 2
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if spans[2 * mid] < pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return 2 * lo
+
+
+def _span_words(sentence, spans):
+    """Yield the words of `sentence` given by the flat offsets `spans`."""
+    for n in xrange(0, len(spans), 2):
+        yield sentence[spans[n]:spans[n + 1]]
+
+
+def _span_tokens(sentence, spans):
+    """Yield the (word, start, end) of `sentence` given by `spans`."""
+    for n in xrange(0, len(spans), 2):
+        start = spans[n]
+        end = spans[n + 1]
+        yield (sentence[start:end], start, end)
+
+
+@contextmanager
+def _cache_lock(path):
+    """
+    Hold an exclusive lock on the file `path` (created if needed) that
+    other processes honour too. Does not lock where fcntl is missing or
+    the file cannot be created.
+    """
+    try:
+        f = open(path, 'a')
+    except (IOError, OSError):
+        f = None
+    if f is None or fcntl is None:
+        try:
+            yield
+        finally:
+            if f is not None:
+                f.close()
+        return
+    with f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_userdict(lines, f_name):
+    """Yield (word, freq, tag) from the lines of a user dictionary."""
+    for line in lines:
+        line = line.strip()
+        if not isinstance(line, text_type):
+            try:
+                line = line.decode('utf-8').lstrip('\ufeff')
+            except UnicodeDecodeError:
+                raise ValueError('dictionary file %s must be utf-8' % f_name)
+        if not line:
+            continue
+        # match won't be None because there's at least one character
+        word, freq, tag = re_userdict.match(line).groups()
+        if freq is not None:
+            freq = freq.strip()
+        if tag is not None:
+            tag = tag.strip()
+        yield word, freq, tag
+
+
+def _read_userdict_source(f):
+    """
+    Return (name, lines, md5 hex digest) of a user dictionary given as a
+    path, a file-like object or an iterable of lines.
+    """
+    if isinstance(f, string_types):
+        f_name = f
+        with open(f, 'rb') as fobj:
+            content = fobj.read()
+    elif hasattr(f, 'read'):
+        f_name = resolve_filename(f)
+        content = f.read()
+    else:
+        f_name = resolve_filename(f)
+        lines = list(f)
+        h = md5()
+        for line in lines:
+            if isinstance(line, text_type):
+                line = line.encode('utf-8')
+            h.update(line + b'\n')
+        return f_name, lines, h.hexdigest()
+    if isinstance(content, text_type):
+        return (f_name, content.split('\n'),
+                md5(content.encode('utf-8')).hexdigest())
+    return f_name, content.split(b'\n'), md5(content).hexdigest()
+
+
+def read_dict(f):
+    """
+    Yield (word, freq) pairs from a dictionary file opened in binary mode,
+    then close it.
+    """
+    f_name = resolve_filename(f)
+    for lineno, line in enumerate(f, 1):
+        try:
+            line = line.strip().decode('utf-8')
+            word, freq = line.split(' ')[:2]
+            freq = int(freq)
+        except ValueError:
+            raise ValueError(
+                'invalid dictionary entry in %s at Line %s: %s' % (f_name, lineno, line))
+        yield word, freq
+    f.close()
+
+
+class LogFreqTable(dict):
+    """
+    Memoized log(freq or 1) - log(total), the weight of a word in the DAG,
+    for one `total`; a dictionary has a few thousand distinct freqs.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.logtotal = log(total)
+
+    def __missing__(self, freq):
+        value = self[freq] = log(freq or 1) - self.logtotal
+        return value
+
+
+class SharedDict(object):
+    """
+    A prefix dict loaded by `Tokenizer.initialize`, and its total.
+    Tokenizers using the same dictionary file share it as the read-only
+    base of their FREQ; their own changes go to an overlay.
+    They share its `LogFreqTable`s too, see `log_freq`.
+    """
+    __slots__ = ('freq', 'total', 'log_freqs', '__weakref__')
+
+    # tables kept for distinct totals, usually a few: the one of the
+    # dictionary and those of tokenizers with user words
+    max_log_freqs = 64
+
+    def __init__(self, freq, total):
+        self.freq = freq
+        self.total = total
+        self.log_freqs = {}
+
+    def log_freq(self, total):
+        """Return the LogFreqTable of `total`, loaded on first use."""
+        table = self.log_freqs.get(total)
+        if table is None:
+            if len(self.log_freqs) >= self.max_log_freqs:
+                self.log_freqs.clear()
+            table = self.log_freqs.setdefault(total, LogFreqTable(total))
+        return table
+
+
+# An immutable version of the dictionary of a Tokenizer and of the POS tags
+# given by user dicts. `version` is bumped on every change; it is None for a
+# private copy that a writer is editing. `key` is the content hash of the
+# dictionary and the user dictionaries loaded into it, in order; None once
+# it was edited some other way.
+DictState = namedtuple('DictState',
+                       ['freq', 'total', 'version', 'tags', 'key'])
+
+
+def _with_tags(tags, items):
+    """
+    Return the user POS `tags` of a DictState, a dict or a `LayeredDict`,
+    with the (word, tag) `items` set; `tags` is left unchanged.
+    """
+    if not isinstance(tags, LayeredDict):
+        tags = LayeredDict(tags)
+    return tags.with_items(items)
+
+
+class UserWordTags(object):
+    """
+    View of the user POS tags of the current dictionary of a tokenizer.
+    Setting a tag is a change of the dictionary, like add_word.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __repr__(self):
+        return repr(self.tokenizer.state.tags)
+
+    def get(self, word, default=None):
+        return self.tokenizer.state.tags.get(word, default)
+
+    def __getitem__(self, word):
+        return self.tokenizer.state.tags[word]
+
+    def __setitem__(self, word, tag):
+        tokenizer = self.tokenizer
+        with tokenizer.lock:
+            state = tokenizer.state
+            tokenizer.replace_dict(state.freq, state.total, tags=_with_tags(
+                state.tags, [(strdecode(word), tag)]))
+
+    def __contains__(self, word):
+        return word in self.tokenizer.state.tags
+
+    def __iter__(self):
+        return iter(self.tokenizer.state.tags)
+
+    def __len__(self):
+        return len(self.tokenizer.state.tags)
+
+    def keys(self):
+        return self.tokenizer.state.tags.keys()
+
+    def items(self):
+        return self.tokenizer.state.tags.items()
+
+
+class Lattice(object):
+    """
+    The DAG and best route of a sentence, built once by `Tokenizer.lattice`
+    and shared by every cut mode: the search mode words and the full mode
+    edges are read from the DAG instead of looking the dictionary up again.
+    """
+
+    def __init__(self, tokenizer, sentence, HMM, state):
+        self.tokenizer = tokenizer
+        self.sentence = sentence
+        self.HMM = HMM
+        self.state = state
+        # (start, end, DAG) of every Han block, in order
+        self.blocks = []
+        self.spans = array('i')
+        tokenizer._cut_spans(sentence, False, HMM, self.spans, state,
+                             cut_block=self.__cut_block)
+        self.search_spans = None
+        self.full_spans = None
+
+    def __repr__(self):
+        return '<Lattice of %d characters>' % len(self.sentence)
+
+    def __cut_block(self, pos, blk):
+        dag = self.tokenizer.get_DAG_arrays(blk, self.state)
+        self.blocks.append((pos, pos + len(blk), dag))
+        return self.tokenizer._dag_spans(blk, dag, False, self.HMM, self.state)
+
+    def offsets(self, mode="default"):
+        """
+        Return the words as flat (start, end) offsets, like
+        `Tokenizer.cut_offsets` in the same mode.
+        """
+        if mode == "default":
+            spans = self.spans
+        elif mode == "search":
+            if self.search_spans is None:
+                self.search_spans = self.__search()
+            spans = self.search_spans
+        elif mode == "all":
+            if self.full_spans is None:
+                self.full_spans = self.__full()
+            spans = self.full_spans
+        else:
+            raise ValueError("jieba: unknown cut mode %r" % mode)
+        return spans[:]
+
+    def __search(self):
+        """`Tokenizer._search_spans` with the DAG edges as dictionary."""
+        spans = self.spans
+        out = array('i')
+        append = out.append
+        blocks = iter(self.blocks)
+        pos = end = 0
+        for n in xrange(0, len(spans), 2):
+            start = spans[n]
+            stop = spans[n + 1]
+            width = stop - start
+            # words of more than 2 characters are all in Han blocks
+            if width > 2:
+                while end < stop:
+                    pos, end, (offsets, ends, _) = next(blocks)
+                for gram in (2, 3):
+                    if width <= gram:
+                        break
+                    for i in xrange(start - pos, stop - pos - gram + 1):
+                        # the edge from i to i + gram - 1 is the word
+                        if i + gram - 1 in ends[offsets[i]:offsets[i + 1]]:
+                            append(pos + i)
+                            append(pos + i + gram)
+            append(start)
+            append(stop)
+        return out
+
+    def __full(self):
+        """Full mode, the Han runs cut with the edges of their block."""
+        blocks = iter(self.blocks)
+        # (start, end, DAG) of the current block
+        block = [(0, 0, None)]
+
+        def cut_block(pos, blk):
+            # a run of Han characters is inside a Han block
+            while block[0][1] < pos + len(blk):
+                block[0] = next(blocks)
+            start, _, dag = block[0]
+            dag = sub_dag(dag, pos - start, pos + len(blk) - start)
+            return self.tokenizer._dag_spans(blk, dag, True, False, None)
+
+        out = array('i')
+        self.tokenizer._cut_spans(self.sentence, True, False, out, self.state,
+                                  cut_block=cut_block)
+        return out
+
+    def _words(self, spans):
+        sentence = self.sentence
+        for n in xrange(0, len(spans), 2):
+            yield sentence[spans[n]:spans[n + 1]]
+
+    def cut(self, cut_all=False):
+        """Like `Tokenizer.cut` with the HMM setting of the lattice."""
+        return self._words(self.offsets("all" if cut_all else "default"))
+
+    def cut_for_search(self):
+        """Like `Tokenizer.cut_for_search`."""
+        return self._words(self.offsets("search"))
+
+    def tokenize(self, mode="default"):
+        """Like `Tokenizer.tokenize`: yield (word, start, end)."""
+        if mode not in ("default", "search"):
+            raise ValueError("jieba: unknown tokenize mode %r" % mode)
+        return _span_tokens(self.sentence, self.offsets(mode))
+
+
+def sub_dag(dag, lo, hi):
+    """
+    Return the DAG of positions lo..hi - 1 of `dag`, without weights: the
+    DAG `get_DAG_arrays` builds for that part of the sentence.
+    """
+    offsets, ends, weights = dag
+    if lo == 0 and hi == len(offsets) - 1:
+        return dag
+    sub_offsets = array('i', [0])
+    sub_ends = array('i')
+    for k in xrange(lo, hi):
+        n = len(sub_ends)
+        for e in xrange(offsets[k], offsets[k + 1]):
+            j = ends[e]
+            if j < hi:
+                sub_ends.append(j - lo)
+        # like get_DAG_arrays, a position with no word is a word
+        if len(sub_ends) == n:
+            sub_ends.append(k - lo)
+        sub_offsets.append(len(sub_ends))
+    return sub_offsets, sub_ends, None
+
+
 class Tokenizer(object):
 
-    def __init__(self, dictionary=DEFAULT_DICT):
+    def __init__(self, dictionary=DEFAULT_DICT, compact=False):
         self.lock = threading.RLock()
         if dictionary == DEFAULT_DICT:
             self.dictionary = dictionary
         else:
             self.dictionary = _get_abs_path(dictionary)
-        self.FREQ = {}
-        self.total = 0
-        self.user_word_tag_tab = {}
+        # readers take self.state once per call and never see it change;
+        # writers build a new one under self.lock and publish it with
+        # replace_dict before returning
+        self.state = DictState({}, 0, 0, {}, None)
         self.initialized = False
         self.tmp_dir = None
         self.cache_file = None
+        # store the prefix dict as a memory-mapped `PrefixDict` instead of a
+        # plain dict: ~10x smaller and shared between processes, but lookups
+        # are slower
+        self.compact = compact
+        # the LogFreqTable of the last total, without a shared_dict
+        self.log_freq = None
+        self.block_cache = None
+        self.result_cache = None
+        # set by initialize_in_background
+        self.init_future = None
+        # the SharedDict under FREQ, kept alive while in use
+        self.shared_dict = None
 
     def __repr__(self):
         return '<Tokenizer dictionary=%r>' % self.dictionary
 
+    @property
+    def FREQ(self):
+        """
+        The prefix dict, read-only: it is the published dictionary, in use
+        by the calls running, and the plain dict loaded by `initialize` is
+        shared by every tokenizer using the same dictionary. Change it with
+        add_word, del_word or load_userdict, or assign a new one, which
+        goes through `replace_dict`.
+        """
+        return self.state.freq
+
+    @FREQ.setter
+    def FREQ(self, FREQ):
+        with self.lock:
+            self.replace_dict(FREQ, self.state.total)
+
+    @property
+    def total(self):
+        return self.state.total
+
+    @total.setter
+    def total(self, total):
+        with self.lock:
+            self.replace_dict(self.state.freq, total)
+
+    @property
+    def dict_key(self):
+        """The content key of the dictionary, see `DictState`."""
+        return self.state.key
+
+    @property
+    def user_word_tag_tab(self):
+        """
+        The POS tags given by user dicts and add_word, as a `UserWordTags`
+        view. Assigning a dict replaces them all.
+        """
+        return UserWordTags(self)
+
+    @user_word_tag_tab.setter
+    def user_word_tag_tab(self, tags):
+        with self.lock:
+            state = self.state
+            self.replace_dict(state.freq, state.total, tags=dict(tags))
+
     def gen_pfdict(self, f):
         lfreq = {}
         ltotal = 0
-        f_name = resolve_filename(f)
-        for lineno, line in enumerate(f, 1):
-            try:
-                line = line.strip().decode('utf-8')
-                word, freq = line.split(' ')[:2]
-                freq = int(freq)
-                lfreq[word] = freq
-                ltotal += freq
-                for ch in xrange(len(word)):
-                    wfrag = word[:ch + 1]
-                    if wfrag not in lfreq:
-                        lfreq[wfrag] = 0
-            except ValueError:
-                raise ValueError(
-                    'invalid dictionary entry in %s at Line %s: %s' % (f_name, lineno, line))
-        f.close()
+        for word, freq in read_dict(f):
+            lfreq[word] = freq
+            ltotal += freq
+            for ch in xrange(len(word)):
+                wfrag = word[:ch + 1]
+                if wfrag not in lfreq:
+                    lfreq[wfrag] = 0
         return lfreq, ltotal
 
+    def gen_prefix_table(self, f):
+        lfreq = {}
+        ltotal = 0
+        for word, freq in read_dict(f):
+            lfreq[word] = freq
+            ltotal += freq
+        return PrefixDict(TrieTable.from_items(iteritems(lfreq))), ltotal
+
+    def get_cache_dir(self):
+        return self.tmp_dir or CACHE_DIR or tempfile.gettempdir()
+
+    def _dict_hash(self):
+        """Return the md5 of the content of the dictionary file."""
+        h = md5()
+        f = self.get_dict_file()
+        try:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        finally:
+            f.close()
+        return h.hexdigest()
+
+    def get_compiled_dict(self):
+        """
+        Return the `CompiledDict` to load instead of parsing the dictionary,
+        or None: the dictionary itself if it is compiled, else
+        ``<dictionary>.compiled`` if it was compiled from the same content
+        and no user dict.
+        """
+        return self._find_compiled_dict()[0]
+
+    def _find_compiled_dict(self):
+        """
+        `get_compiled_dict`, returning (compiled, dict_hash): dict_hash is
+        the `_dict_hash()` it computed to check ``<dictionary>.compiled``,
+        None if it did not have to, so that the caller does not read the
+        dictionary again.
+        """
+        path = self.dictionary
+        if path == DEFAULT_DICT:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                DEFAULT_DICT_NAME)
+        elif is_compiled(path):
+            return CompiledDict(path), None
+        path += COMPILED_SUFFIX
+        if not os.path.isfile(path):
+            return None, None
+        try:
+            compiled = CompiledDict(path)
+        except ValueError as e:
+            default_logger.warning("Ignoring %s: %s" % (path, e))
+            return None, None
+        dict_hash = self._dict_hash()
+        if compiled.source_key != dict_hash:
+            default_logger.debug(
+                "Ignoring %s, compiled from another dictionary" % path)
+            return None, dict_hash
+        if compiled.dict_key != compiled.source_key:
+            default_logger.warning(
+                "Ignoring %s, compiled with user dicts" % path)
+            return None, dict_hash
+        return compiled, dict_hash
+
+    def _load_cache(self, cache_file, abs_path):
+        """Return (FREQ, total) from `cache_file`, None if missing or stale."""
+        if not os.path.isfile(cache_file):
+            return None
+        # caches named after the dictionary content cannot be stale
+        if (self.cache_file and abs_path != DEFAULT_DICT and
+                os.path.getmtime(cache_file) <= os.path.getmtime(abs_path)):
+            return None
+        default_logger.debug("Loading model from cache %s" % cache_file)
+        t1 = time.time()
+        try:
+            if self.compact:
+                table, total = TrieTable.load(cache_file)
+                loaded = PrefixDict(table), total
+            else:
+                # loads() of the whole file is much faster than load()
+                with open(cache_file, 'rb') as cf:
+                    loaded = marshal.loads(cf.read())
+        except Exception:
+            return None
+        default_logger.debug(
+            "Loading cache cost %.3f seconds." % (time.time() - t1))
+        return loaded
+
     def initialize(self, dictionary=None):
         if dictionary:
             abs_path = _get_abs_path(dictionary)
@@ -110,164 +719,640 @@ class Tokenizer(object):
 
             default_logger.debug("Building prefix dict from %s ..." % (abs_path or 'the default dictionary'))
             t1 = time.time()
+            compiled, dict_key = self._find_compiled_dict()
+            if compiled is not None:
+                dict_key = compiled.dict_key
+            elif dict_key is None:
+                dict_key = self._dict_hash()
             if self.cache_file:
                 cache_file = self.cache_file
-            # default dictionary
-            elif abs_path == DEFAULT_DICT:
-                cache_file = "jieba.cache"
-            # custom dictionary
             else:
-                cache_file = "jieba.u%s.cache" % md5(
-                    abs_path.encode('utf-8', 'replace')).hexdigest()
-            cache_file = os.path.join(
-                self.tmp_dir or tempfile.gettempdir(), cache_file)
-            # prevent absolute path in self.cache_file
-            tmpdir = os.path.dirname(cache_file)
-
-            load_from_cache_fail = True
-            if os.path.isfile(cache_file) and (abs_path == DEFAULT_DICT or
-                os.path.getmtime(cache_file) > os.path.getmtime(abs_path)):
+                cache_file = "jieba.u%s.cache" % dict_key
+                if self.compact:
+                    cache_file = "jieba.u%s.compact.cache" % dict_key
+            cache_file = os.path.join(self.get_cache_dir(), cache_file)
+
+            shared = SHARED_DICTS.get((dict_key, self.compact))
+            if shared is not None:
+                default_logger.debug("Sharing the prefix dict already loaded")
+            elif compiled is not None:
                 default_logger.debug(
-                    "Loading model from cache %s" % cache_file)
-                try:
-                    with open(cache_file, 'rb') as cf:
-                        self.FREQ, self.total = marshal.load(cf)
-                    load_from_cache_fail = False
-                except Exception:
-                    load_from_cache_fail = True
-
-            if load_from_cache_fail:
-                wlock = DICT_WRITING.get(abs_path, threading.RLock())
-                DICT_WRITING[abs_path] = wlock
-                with wlock:
-                    self.FREQ, self.total = self.gen_pfdict(self.get_dict_file())
-                    default_logger.debug(
-                        "Dumping model to file cache %s" % cache_file)
-                    try:
-                        # prevent moving across different filesystems
-                        fd, fpath = tempfile.mkstemp(dir=tmpdir)
-                        with os.fdopen(fd, 'wb') as temp_cache_file:
-                            marshal.dump(
-                                (self.FREQ, self.total), temp_cache_file)
-                        _replace_file(fpath, cache_file)
-                    except Exception:
-                        default_logger.exception("Dump cache file failed.")
-
-                try:
-                    del DICT_WRITING[abs_path]
-                except KeyError:
-                    pass
+                    "Loading compiled dictionary %s" % compiled.path)
+                shared = SHARED_DICTS.setdefault(
+                    (dict_key, self.compact),
+                    SharedDict(*compiled.load(self.compact)))
+            else:
+                loaded = self._load_cache(cache_file, abs_path)
+                if loaded is None:
+                    wlock = DICT_WRITING.get(abs_path, threading.RLock())
+                    DICT_WRITING[abs_path] = wlock
+                    # only one process builds the cache, the others wait for it
+                    with wlock, _cache_lock(cache_file + ".lock"):
+                        loaded = self._load_cache(cache_file, abs_path)
+                        if loaded is None:
+                            loaded = self._build_cache(cache_file)
 
+                    try:
+                        del DICT_WRITING[abs_path]
+                    except KeyError:
+                        pass
+                shared = SHARED_DICTS.setdefault(
+                    (dict_key, self.compact), SharedDict(*loaded))
+
+            self.shared_dict = shared
+            self.replace_dict(shared.freq, shared.total, dict_key)
             self.initialized = True
             default_logger.debug(
                 "Loading model cost %.3f seconds." % (time.time() - t1))
             default_logger.debug("Prefix dict has been built succesfully.")
 
+    def _build_cache(self, cache_file):
+        """Parse the dictionary, save it to `cache_file`; return (FREQ, total)."""
+        t1 = time.time()
+        if self.compact:
+            FREQ, total = self.gen_prefix_table(self.get_dict_file())
+        else:
+            FREQ, total = self.gen_pfdict(self.get_dict_file())
+        default_logger.debug(
+            "Parsing dictionary cost %.3f seconds." % (time.time() - t1))
+        default_logger.debug("Dumping model to file cache %s" % cache_file)
+        t1 = time.time()
+        try:
+            # prevent moving across different filesystems
+            fd, fpath = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+            with os.fdopen(fd, 'wb') as temp_cache_file:
+                if self.compact:
+                    FREQ.base.dump(temp_cache_file, total)
+                else:
+                    marshal.dump((FREQ, total), temp_cache_file)
+            _replace_file(fpath, cache_file)
+            if self.compact:
+                # share the mapped pages with other processes
+                table, _ = TrieTable.load(cache_file)
+                FREQ = PrefixDict(table)
+            default_logger.debug(
+                "Dumping cache cost %.3f seconds." % (time.time() - t1))
+        except Exception:
+            default_logger.exception("Dump cache file failed.")
+        return FREQ, total
+
     def check_initialized(self):
         if not self.initialized:
             self.initialize()
 
+    def initialize_in_background(self, dictionary=None):
+        """
+        Run `initialize` in a daemon thread and return a
+        concurrent.futures.Future resolving to this tokenizer once the
+        dictionary is loaded. `future.done()` tells whether it is ready;
+        segmentation calls made before then wait for it.
+        Calling it again while loading returns the same future.
+        """
+        from concurrent.futures import Future
+        # not self.lock: initialize holds it while loading
+        with INIT_FUTURE_LOCK:
+            future = self.init_future
+            if future is not None and not future.done():
+                return future
+            future = self.init_future = Future()
+        if self.initialized and not dictionary:
+            future.set_result(self)
+            return future
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                self.initialize(dictionary)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(self)
+
+        thread = threading.Thread(target=run, name='jieba-initialize')
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def initialize_async(self, dictionary=None):
+        """
+        Awaitable version of `initialize_in_background`, to be called
+        from a coroutine: ``await tokenizer.initialize_async()``.
+        """
+        import asyncio
+        return asyncio.wrap_future(self.initialize_in_background(dictionary))
+
+    def replace_dict(self, FREQ, total, dict_key=None, tags=None):
+        """
+        Atomically make `FREQ` and `total` (and the user POS `tags`, which
+        are kept if None) the dictionary of the calls starting from now;
+        calls already running finish with the previous one. They must not
+        be modified afterwards.
+        `dict_key` identifies the content for the user dictionary caches
+        and the result cache.
+        """
+        with self.lock:
+            state = self.state
+            if tags is None:
+                tags = state.tags
+            self.state = DictState(
+                FREQ, total, state.version + 1, tags, dict_key)
+            if self.block_cache is not None:
+                self.block_cache.clear()
+
+    def _draft(self, state=None):
+        """
+        Return a private copy of the dictionary (`state`, the current one by
+        default) for a writer to edit: a PrefixDict whose base is shared and
+        whose overlay is copied, and a copy of the user tags.
+        """
+        if state is None:
+            state = self.state
+        FREQ = state.freq
+        if isinstance(FREQ, PrefixDict):
+            FREQ = PrefixDict(FREQ.base, FREQ.changes())
+        else:
+            FREQ = PrefixDict(FREQ)
+        return DictState(FREQ, state.total, None, dict(state.tags), None)
+
+    def enable_block_cache(self, maxsize=1024):
+        """
+        Remember the segmentation of up to `maxsize` recently seen Han
+        blocks, so that repeated names and phrases are only cut once.
+        The cache is emptied whenever the dictionary changes.
+        """
+        self.block_cache = BlockCache(maxsize)
+
+    def disable_block_cache(self):
+        self.block_cache = None
+
+    def cache_info(self):
+        """Return (hits, misses, maxsize, currsize) of the block cache."""
+        if self.block_cache is None:
+            return None
+        return self.block_cache.info()
+
+    def enable_result_cache(self, path=None, max_bytes=64 << 20,
+                            min_chars=256):
+        """
+        Keep the segmentation of texts of `min_chars` characters or more
+        in an sqlite database, so that cutting the same text again, in
+        this process or a later one, only reads the result. It is used by
+        cut, cut_for_search, tokenize, cut_offsets and cut_batch.
+        Parameter:
+            - path: The database, jieba.results.db in the cache directory
+                    by default. Processes can share it.
+            - max_bytes: The least recently used results are evicted past
+                         this size.
+            - min_chars: Shorter texts are always cut.
+        Results are keyed by the content of the dictionary and of the user
+        dicts loaded, so texts are cut again after a change; after
+        add_word, del_word or suggest_freq(tune=True), which leave the
+        dictionary without a key, they are not cached at all.
+        """
+        if path is None:
+            path = os.path.join(self.get_cache_dir(), "jieba.results.db")
+        self.disable_result_cache()
+        self.result_cache = ResultCache(path, max_bytes, min_chars)
+
+    def disable_result_cache(self):
+        cache = self.result_cache
+        self.result_cache = None
+        if cache is not None:
+            cache.close()
+
+    def _cached_offsets(self, sentence, mode, HMM, state, memo=None):
+        """`_offsets` through the result cache, if enabled."""
+        cache = self.result_cache
+        if (cache is None or state.key is None or
+                len(sentence) < cache.min_chars):
+            return self._offsets(sentence, mode, HMM, state, memo)
+        if mode == "all":
+            # full mode does not use the HMM
+            HMM = False
+        spans = cache.get(sentence, mode, HMM, state.key)
+        if spans is None:
+            spans = self._offsets(sentence, mode, HMM, state, memo)
+            cache.put(sentence, mode, HMM, state.key, spans)
+        return spans
+
+    def _use_result_cache(self, sentence):
+        cache = self.result_cache
+        return cache is not None and len(sentence) >= cache.min_chars
+
     def calc(self, sentence, DAG, route):
+        FREQ, total = self.state[:2]
         N = len(sentence)
         route[N] = (0, 0)
-        logtotal = log(self.total)
+        logtotal = log(total)
         for idx in xrange(N - 1, -1, -1):
-            route[idx] = max((log(self.FREQ.get(sentence[idx:x + 1]) or 1) -
+            route[idx] = max((log(FREQ.get(sentence[idx:x + 1]) or 1) -
                               logtotal + route[x + 1][0], x) for x in DAG[idx])
 
     def get_DAG(self, sentence):
         self.check_initialized()
+        offsets, ends, _ = self.get_DAG_arrays(sentence)
         DAG = {}
+        for k in xrange(len(sentence)):
+            DAG[k] = ends[offsets[k]:offsets[k + 1]].tolist()
+        return DAG
+
+    def _log_freq(self, total):
+        """
+        Return the LogFreqTable of `total`, the one of the SharedDict the
+        tokenizer was initialized with if any.
+        """
+        if self.shared_dict is not None:
+            return self.shared_dict.log_freq(total)
+        table = self.log_freq
+        if table is None or table.total != total:
+            table = self.log_freq = LogFreqTable(total)
+        return table
+
+    def get_DAG_arrays(self, sentence, state=None):
+        """
+        Build the DAG of `sentence` in CSR form: the edges leaving position
+        k are ends[offsets[k]:offsets[k + 1]] (inclusive end positions, in
+        increasing order), each weighted by log(freq) - log(total).
+        `state` is the DictState to use, the current one by default.
+        """
+        if state is None:
+            self.check_initialized()
+            state = self.state
+        FREQ = state.freq
+        overlay_get = None
+        if isinstance(FREQ, PrefixDict):
+            if isinstance(FREQ.base, TrieTable):
+                return self._walk_DAG(sentence, FREQ, state.total)
+            # PrefixDict.get inlined, the base is usually a plain dict
+            overlay_get = FREQ.overlay_lookup()
+            FREQ = FREQ.base
+        log_freq = self._log_freq(state.total)
         N = len(sentence)
+        offsets = array('i', [0])
+        ends = array('i')
+        weights = array('d')
         for k in xrange(N):
-            tmplist = []
+            n = len(ends)
             i = k
             frag = sentence[k]
-            while i < N and frag in self.FREQ:
-                if self.FREQ[frag]:
-                    tmplist.append(i)
+            while i < N:
+                if overlay_get is None:
+                    freq = FREQ.get(frag)
+                else:
+                    freq = overlay_get(frag)
+                    if freq is None:
+                        freq = FREQ.get(frag)
+                if freq is None:
+                    break
+                if freq:
+                    ends.append(i)
+                    weights.append(log_freq[freq])
                 i += 1
                 frag = sentence[k:i + 1]
-            if not tmplist:
-                tmplist.append(k)
-            DAG[k] = tmplist
-        return DAG
+            if len(ends) == n:
+                ends.append(k)
+                weights.append(log_freq[0])
+            offsets.append(len(ends))
+        return offsets, ends, weights
 
-    def __cut_all(self, sentence):
-        dag = self.get_DAG(sentence)
+    def _walk_DAG(self, sentence, FREQ, total):
+        """
+        `get_DAG_arrays` for a PrefixDict over a TrieTable: the words
+        starting at k are found by walking down the trie from the node of
+        sentence[k], one character at a time, instead of looking up every
+        fragment from the root. Fragments are only sliced, to be looked up
+        in the overlay, where a word of the overlay starts.
+        """
+        table = FREQ.base
+        first = table.first
+        chars = table.chars
+        freqs = table.freqs
+        root = table.root_index().get
+        overlay_get = FREQ.overlay_lookup()
+        if overlay_get is not None:
+            overlay_starts = FREQ.overlay_starts()
+        log_freq = self._log_freq(total)
+        N = len(sentence)
+        codes = list(map(ord, sentence))
+        offsets = array('i', [0])
+        ends = array('i')
+        weights = array('d')
+        for k in xrange(N):
+            n = len(ends)
+            probe = overlay_get is not None and codes[k] in overlay_starts
+            node = root(codes[k], -1)
+            i = k
+            while True:
+                freq = freqs[node] if node > 0 else None
+                if probe:
+                    f = overlay_get(sentence[k:i + 1])
+                    if f is not None:
+                        freq = f
+                if freq is None:
+                    break
+                if freq:
+                    ends.append(i)
+                    weights.append(log_freq[freq])
+                i += 1
+                if i == N:
+                    break
+                if node > 0:
+                    lo = first[node]
+                    hi = first[node + 1]
+                    code = codes[i]
+                    node = bisect_left(chars, code, lo, hi)
+                    if node == hi or chars[node] != code:
+                        node = -1
+            if len(ends) == n:
+                ends.append(k)
+                weights.append(log_freq[0])
+            offsets.append(len(ends))
+        return offsets, ends, weights
+
+    def calc_route(self, dag):
+        """
+        Return the max-probability route through a DAG built by
+        `get_DAG_arrays`: route[k] is the end (exclusive) of the word
+        starting at k.
+        """
+        offsets, ends, weights = dag
+        N = len(offsets) - 1
+        best = array('d', [0.0]) * (N + 1)
+        route = array('i', [0]) * N
+        for idx in xrange(N - 1, -1, -1):
+            e = offsets[idx]
+            hi = offsets[idx + 1]
+            x = ends[e]
+            prob = weights[e] + best[x + 1]
+            for e in xrange(e + 1, hi):
+                y = ends[e]
+                p = weights[e] + best[y + 1]
+                # ties go to the longer word, like max() over (prob, x)
+                if p >= prob:
+                    prob = p
+                    x = y
+            best[idx] = prob
+            route[idx] = x + 1
+        return route
+
+    def __cut_all(self, sentence, dag, base, out):
+        offsets, ends, _ = dag
         old_j = -1
-        for k, L in iteritems(dag):
-            if len(L) == 1 and k > old_j:
-                yield sentence[k:L[0] + 1]
-                old_j = L[0]
+        for k in xrange(len(sentence)):
+            lo = offsets[k]
+            hi = offsets[k + 1]
+            if hi - lo == 1 and k > old_j:
+                old_j = ends[lo]
+                out.append(base + k)
+                out.append(base + old_j + 1)
             else:
-                for j in L:
+                for e in xrange(lo, hi):
+                    j = ends[e]
                     if j > k:
-                        yield sentence[k:j + 1]
+                        out.append(base + k)
+                        out.append(base + j + 1)
                         old_j = j
 
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.get_DAG(sentence)
-        route = {}
-        self.calc(sentence, DAG, route)
+    def __cut_DAG_NO_HMM(self, sentence, route, base, out):
         x = 0
         N = len(sentence)
-        buf = ''
+        buf = -1
         while x < N:
-            y = route[x][1] + 1
-            l_word = sentence[x:y]
-            if re_eng.match(l_word) and len(l_word) == 1:
-                buf += l_word
-                x = y
+            y = route[x]
+            if y - x == 1 and re_eng.match(sentence, x):
+                if buf < 0:
+                    buf = x
             else:
-                if buf:
-                    yield buf
-                    buf = ''
-                yield l_word
-                x = y
-        if buf:
-            yield buf
-            buf = ''
-
-    def __cut_DAG(self, sentence):
-        DAG = self.get_DAG(sentence)
-        route = {}
-        self.calc(sentence, DAG, route)
+                if buf >= 0:
+                    out.append(base + buf)
+                    out.append(base + x)
+                    buf = -1
+                out.append(base + x)
+                out.append(base + y)
+            x = y
+        if buf >= 0:
+            out.append(base + buf)
+            out.append(base + N)
+
+    def __cut_DAG(self, sentence, route, base, out, state):
+        append = out.append
         x = 0
-        buf = ''
+        buf = -1
         N = len(sentence)
         while x < N:
-            y = route[x][1] + 1
-            l_word = sentence[x:y]
+            y = route[x]
             if y - x == 1:
-                buf += l_word
+                if buf < 0:
+                    buf = x
             else:
-                if buf:
-                    if len(buf) == 1:
-                        yield buf
-                        buf = ''
-                    else:
-                        if not self.FREQ.get(buf):
-                            recognized = finalseg.cut(buf)
-                            for t in recognized:
-                                yield t
-                        else:
-                            for elem in buf:
-                                yield elem
-                        buf = ''
-                yield l_word
+                if buf >= 0:
+                    self.__cut_buf(sentence, buf, x, base, out, state)
+                    buf = -1
+                append(base + x)
+                append(base + y)
             x = y
+        if buf >= 0:
+            self.__cut_buf(sentence, buf, N, base, out, state)
+
+    def __cut_buf(self, sentence, start, end, base, out, state):
+        """Cut a run of single characters left by the route, using the HMM."""
+        if end - start > 1:
+            buf = sentence[start:end]
+            if not state.freq.get(buf):
+                for t in finalseg.cut(buf):
+                    out.append(base + start)
+                    start += len(t)
+                    out.append(base + start)
+                return
+        for x in xrange(start, end):
+            out.append(base + x)
+            out.append(base + x + 1)
 
-        if buf:
-            if len(buf) == 1:
-                yield buf
-            elif not self.FREQ.get(buf):
-                recognized = finalseg.cut(buf)
-                for t in recognized:
-                    yield t
+    def _block_spans(self, blk, cut_all, HMM, state, memo=None):
+        """
+        Return the offsets of the words of the Han block `blk`, relative to
+        it. They are looked up in `memo` (a dict of blocks) and the block
+        cache first; the returned array must not be modified.
+        """
+        if memo is not None:
+            spans = memo.get(blk)
+            if spans is not None:
+                return spans
+        cache = self.block_cache
+        # drafts being edited have no version and are not cached
+        if state.version is None:
+            cache = None
+        if cache is not None:
+            key = (blk, cut_all, HMM and not cut_all, state.version)
+            spans = cache.get(key)
+        else:
+            spans = None
+        if spans is None:
+            if cut_all:
+                spans = self._cut_all_spans(blk, state)
             else:
-                for elem in buf:
-                    yield elem
+                spans = self._dag_spans(
+                    blk, self.get_DAG_arrays(blk, state), False, HMM, state)
+            if cache is not None:
+                cache.put(key, spans)
+        if memo is not None:
+            memo[blk] = spans
+        return spans
+
+    def _dag_spans(self, blk, dag, cut_all, HMM, state):
+        """
+        Return the offsets of the words of the Han block `blk`, relative to
+        it, given its DAG. Full mode only uses the edges of the DAG.
+        """
+        spans = array('i')
+        if cut_all:
+            self.__cut_all(blk, dag, 0, spans)
+        elif HMM:
+            self.__cut_DAG(blk, self.calc_route(dag), 0, spans, state)
+        else:
+            self.__cut_DAG_NO_HMM(blk, self.calc_route(dag), 0, spans)
+        return spans
+
+    def _automaton(self, FREQ):
+        """
+        Return the full mode `Automaton` of the base of `FREQ`, or None if
+        it is not a `TrieTable`: a plain dict would have to be turned into
+        a trie first, which costs more time and memory than the DAG scans
+        it saves.
+        """
+        base = FREQ.base if isinstance(FREQ, PrefixDict) else FREQ
+        if not isinstance(base, TrieTable):
+            return None
+        automaton = base._automaton
+        if automaton is None:
+            # built once for every thread
+            with self.lock:
+                automaton = base.automaton()
+        return automaton
+
+    def build_automaton(self):
+        """
+        Build the automaton of full mode now instead of on the first full
+        mode cut, for instance before forking workers, which then share
+        it. Returns None where full mode uses the DAG: for dictionaries
+        that are not compact.
+        """
+        self.check_initialized()
+        FREQ = self.state.freq
+        automaton = self._automaton(FREQ)
+        if (automaton is not None and isinstance(FREQ, PrefixDict) and
+                (FREQ.overlay or FREQ.recent)):
+            FREQ.overlay_automaton(automaton.table)
+        return automaton
+
+    def _cut_all_spans(self, blk, state):
+        """
+        Return the full mode offsets of the words of the Han block `blk`,
+        found in one pass of the dictionary automaton. Same result as
+        `__cut_all` over the DAG: every word of two characters or more,
+        and the characters past the end of the last word emitted.
+        """
+        FREQ = state.freq
+        automaton = self._automaton(FREQ)
+        if automaton is None:
+            return self._dag_spans(
+                blk, self.get_DAG_arrays(blk, state), True, False, state)
+        keys = []
+        if isinstance(FREQ, PrefixDict) and (FREQ.overlay or FREQ.recent):
+            extra, skip = FREQ.overlay_automaton(automaton.table)
+            automaton.find_words(blk, keys, skip)
+            extra.find_words(blk, keys)
+        else:
+            automaton.find_words(blk, keys)
+        keys.sort()
+        N = len(blk)
+        width = N + 1
+        spans = array('i')
+        append = spans.append
+        old_j = -1
+        for key in keys:
+            k, j = divmod(key, width)
+            while old_j < k - 1:
+                old_j += 1
+                append(old_j)
+                append(old_j + 1)
+            append(k)
+            append(j + 1)
+            old_j = j
+        while old_j < N - 1:
+            old_j += 1
+            append(old_j)
+            append(old_j + 1)
+        return spans
+
+    def _cut_spans(self, sentence, cut_all, HMM, out, state, memo=None,
+                   cut_block=None):
+        """
+        Append the flat (start, end) offsets of the words of `sentence` to
+        the array `out`. `memo`, if given, maps Han blocks to their offsets
+        and is filled as blocks are cut. `cut_block(pos, blk)`, if given,
+        returns the offsets of the block `blk` found at `pos` instead of
+        `_block_spans`.
+        """
+        if cut_all:
+            blocks = scanner.CUT_ALL
+        else:
+            blocks = scanner.DEFAULT
+        kinds = blocks.kinds
+        append = out.append
+        # full mode: start of the text since the last separator or block
+        start = -1
+        for m in blocks.finditer(sentence):
+            kind = kinds[m.lastindex]
+            if kind is BLOCK:
+                pos = m.start()
+                if start >= 0:
+                    append(start)
+                    append(pos)
+                    start = -1
+                if cut_block is None:
+                    spans = self._block_spans(
+                        m.group(), cut_all, HMM, state, memo)
+                else:
+                    spans = cut_block(pos, m.group())
+                for x in spans:
+                    append(pos + x)
+            elif not cut_all:
+                append(m.start())
+                append(m.end())
+            elif kind is SEP:
+                # separators are dropped, so the empty pieces around
+                # them are words too, as in the original re.split()
+                if start < 0:
+                    start = m.start()
+                append(start)
+                append(m.start())
+                start = m.end()
+            elif start < 0:
+                start = m.start()
+        if start >= 0:
+            append(start)
+            append(len(sentence))
+
+    def _search_spans(self, sentence, spans, out, FREQ):
+        """Expand accurate-mode `spans` with the 2-grams and 3-grams in FREQ."""
+        for n in xrange(0, len(spans), 2):
+            start = spans[n]
+            end = spans[n + 1]
+            width = end - start
+            if width > 2:
+                for i in xrange(start, end - 1):
+                    if FREQ.get(sentence[i:i + 2]):
+                        out.append(i)
+                        out.append(i + 2)
+            if width > 3:
+                for i in xrange(start, end - 2):
+                    if FREQ.get(sentence[i:i + 3]):
+                        out.append(i)
+                        out.append(i + 3)
+            out.append(start)
+            out.append(end)
 
     def cut(self, sentence, cut_all=False, HMM=True):
         '''
@@ -278,55 +1363,168 @@ class Tokenizer(object):
             - cut_all: Model type. True for full pattern, False for accurate pattern.
             - HMM: Whether to use the Hidden Markov Model.
         '''
+        self.check_initialized()
         sentence = strdecode(sentence)
+        state = self.state
+        if self._use_result_cache(sentence):
+            return _span_words(sentence, self._cached_offsets(
+                sentence, "all" if cut_all else "default", HMM, state))
+        return self._cut(sentence, cut_all, HMM, state)
+
+    def _cut(self, sentence, cut_all, HMM, state):
+        spans = array('i')
+        self._cut_spans(sentence, cut_all, HMM, spans, state)
+        return _span_words(sentence, spans)
+
+    def _offsets(self, sentence, mode, HMM, state, memo=None):
+        if mode not in ("default", "search", "all"):
+            raise ValueError("jieba: unknown cut mode %r" % mode)
+        spans = array('i')
+        self._cut_spans(sentence, mode == "all", HMM, spans, state, memo)
+        if mode == "search":
+            words = spans
+            spans = array('i')
+            self._search_spans(sentence, words, spans, state.freq)
+        return spans
+
+    def cut_offsets(self, unicode_sentence, mode="default", HMM=True):
+        """
+        Segment a sentence without creating a string per word.
+        Returns an array('i') of flat (start, end) offsets into the
+        sentence: word i is sentence[spans[2 * i]:spans[2 * i + 1]].
+        Parameter:
+            - sentence: the str(unicode) to be segmented.
+            - mode: "default" (like `cut`), "search" (like `tokenize` in
+                    search mode) or "all" (like `cut` with cut_all=True).
+            - HMM: whether to use the Hidden Markov Model.
+        """
+        if not isinstance(unicode_sentence, text_type):
+            raise ValueError("jieba: the input parameter should be unicode.")
+        self.check_initialized()
+        return self._cached_offsets(unicode_sentence, mode, HMM, self.state)
 
-        if cut_all:
-            re_han = re_han_cut_all
-            re_skip = re_skip_cut_all
-        else:
-            re_han = re_han_default
-            re_skip = re_skip_default
-        if cut_all:
-            cut_block = self.__cut_all
-        elif HMM:
-            cut_block = self.__cut_DAG
+    def recut(self, old_sentence, old_spans, sentence, HMM=True):
+        """
+        Re-segment an edited sentence, cutting only the blocks touched by
+        the edit and reusing the rest of the previous segmentation.
+        Returns the same offsets as cut_offsets(sentence, HMM=HMM).
+        Parameter:
+            - old_sentence: the str(unicode) before the edit.
+            - old_spans: cut_offsets(old_sentence, HMM=HMM), computed with
+                         the current dictionary.
+            - sentence: the str(unicode) after the edit.
+            - HMM: whether to use the Hidden Markov Model.
+        """
+        if not (isinstance(old_sentence, text_type) and
+                isinstance(sentence, text_type)):
+            raise ValueError("jieba: the input parameter should be unicode.")
+        self.check_initialized()
+        old_len = len(old_sentence)
+        new_len = len(sentence)
+        if old_spans and old_spans[-1] != old_len:
+            raise ValueError("jieba: old_spans do not match old_sentence")
+        prefix = _common_prefix(old_sentence, sentence)
+        suffix = _common_suffix(old_sentence, sentence,
+                                min(old_len, new_len) - prefix)
+        delta = new_len - old_len
+        # widen the edit to word boundaries valid in both texts
+        start = prefix
+        while not (_is_boundary(sentence, start) and
+                   _is_boundary(old_sentence, start)):
+            start -= 1
+        end = new_len - suffix
+        while not (_is_boundary(sentence, end) and
+                   _is_boundary(old_sentence, end - delta)):
+            end += 1
+        i = _span_index(old_spans, start)
+        j = _span_index(old_spans, end - delta)
+        if (i < len(old_spans) and old_spans[i] != start or
+                j < len(old_spans) and old_spans[j] != end - delta):
+            raise ValueError("jieba: old_spans do not match old_sentence")
+        spans = old_spans[:i]
+        middle = array('i')
+        self._cut_spans(sentence[start:end], False, HMM, middle, self.state)
+        spans.extend(array('i', map(start.__add__, middle)))
+        if delta:
+            spans.extend(array('i', map(delta.__add__, old_spans[j:])))
         else:
-            cut_block = self.__cut_DAG_NO_HMM
-        blocks = re_han.split(sentence)
-        for blk in blocks:
-            if not blk:
-                continue
-            if re_han.match(blk):
-                for word in cut_block(blk):
-                    yield word
-            else:
-                tmp = re_skip.split(blk)
-                for x in tmp:
-                    if re_skip.match(x):
-                        yield x
-                    elif not cut_all:
-                        for xx in x:
-                            yield xx
-                    else:
-                        yield x
+            spans.extend(old_spans[j:])
+        return spans
+
+    def cut_stream(self, source, chunk_chars=65536, cut_all=False, HMM=True):
+        """
+        Segment a text too large to hold in memory. Yields the same words
+        as `cut` over the whole text, reading it `chunk_chars` characters at
+        a time and never splitting a block between two reads.
+        Parameter:
+            - source: A file object (text, or binary utf-8) or an iterable of
+                      str(unicode) / utf-8 bytes pieces, e.g. lines.
+            - chunk_chars: Approximate number of characters cut at once,
+                           at least 1.
+            - cut_all: Model type. True for full pattern, False for accurate pattern.
+            - HMM: Whether to use the Hidden Markov Model.
+        """
+        if chunk_chars <= 0:
+            raise ValueError("jieba: chunk_chars must be positive")
+        return self._cut_stream(source, chunk_chars, cut_all, HMM)
+
+    def _cut_stream(self, source, chunk_chars, cut_all, HMM):
+        is_boundary = _is_boundary_cut_all if cut_all else _is_boundary
+        for chunk in _stream_chunks(source, chunk_chars, is_boundary):
+            for word in self.cut(chunk, cut_all, HMM):
+                yield word
+
+    def lattice(self, sentence, HMM=True):
+        """
+        Build the DAG and best route of `sentence` once, to get several
+        segmentations of it without cutting it again for each, e.g.
+        ``lat = tokenizer.lattice(text)`` then ``lat.cut()`` and
+        ``lat.cut_for_search()``. See `Lattice`.
+        """
+        self.check_initialized()
+        return Lattice(self, strdecode(sentence), HMM, self.state)
+
+    def cut_batch(self, texts, mode="default", HMM=True, memo_size=65536):
+        """
+        Segment many documents in one call.
+        Returns a list with one `cut_offsets`-style array per document.
+        Han blocks repeated across the batch are only cut once, as long as
+        the blocks remembered stay under `memo_size`; past it they are
+        forgotten, so a large corpus is cut in bounded memory.
+        Parameter:
+            - texts: An iterable of str(unicode) documents.
+            - mode: "default", "search" or "all" (full pattern).
+            - HMM: Whether to use the Hidden Markov Model.
+            - memo_size: Number of distinct blocks remembered.
+        """
+        if mode not in ("default", "search", "all"):
+            raise ValueError("jieba: unknown cut mode %r" % mode)
+        self.check_initialized()
+        state = self.state
+        memo = {}
+        result = []
+        for text in texts:
+            if len(memo) > memo_size:
+                memo.clear()
+            result.append(self._cached_offsets(
+                strdecode(text), mode, HMM, state, memo))
+        return result
 
     def cut_for_search(self, sentence, HMM=True):
         """
         Finer segmentation for search engines.
         """
-        words = self.cut(sentence, HMM=HMM)
-        for w in words:
-            if len(w) > 2:
-                for i in xrange(len(w) - 1):
-                    gram2 = w[i:i + 2]
-                    if self.FREQ.get(gram2):
-                        yield gram2
-            if len(w) > 3:
-                for i in xrange(len(w) - 2):
-                    gram3 = w[i:i + 3]
-                    if self.FREQ.get(gram3):
-                        yield gram3
-            yield w
+        self.check_initialized()
+        sentence = strdecode(sentence)
+        state = self.state
+        if self._use_result_cache(sentence):
+            return _span_words(sentence, self._cached_offsets(
+                sentence, "search", HMM, state))
+        return self._cut_for_search(sentence, HMM, state)
+
+    def _cut_for_search(self, sentence, HMM, state):
+        return _span_words(
+            sentence, self._offsets(sentence, "search", HMM, state))
 
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
@@ -364,47 +1562,160 @@ class Tokenizer(object):
         word2 freq2 word_type2
         ...
         Word type may be ignored
+
+        The changes are cached in the cache directory, keyed by the content
+        of the dictionary and of every user dict loaded so far, so loading
+        the same files again in another process only reads the cache.
+        '''
+        self.load_userdicts([f])
+
+    def load_userdicts(self, sources):
+        '''
+        Load several personalized dicts, like `load_userdict` on each in
+        turn, but parsing them all first and copying the dictionary once.
+        Parameter:
+            - sources: Paths, file-like objects or iterables of lines, in
+                       the format of `load_userdict`.
         '''
         self.check_initialized()
-        if isinstance(f, string_types):
-            f_name = f
-            f = open(f, 'rb')
-        else:
-            f_name = resolve_filename(f)
-        for lineno, ln in enumerate(f, 1):
-            line = ln.strip()
-            if not isinstance(line, text_type):
+        sources = [_read_userdict_source(f) for f in sources]
+        with self.lock:
+            draft, dict_key = self._apply_userdicts(
+                self.state, self.dict_key, sources)
+            self.replace_dict(draft.freq, draft.total, dict_key, draft.tags)
+
+    def _apply_userdicts(self, state, dict_key, sources, cache=True):
+        """
+        Add the words of the sources read by `_read_userdict_source` to a
+        private copy of the DictState `state`, whose content key is
+        `dict_key`. Returns the new state and its content key; nothing is
+        published. With `cache`, the changes are read from and saved to the
+        cache directory.
+        """
+        base_key = dict_key
+        cache_file = None
+        if base_key is not None:
+            digests = [digest for _, _, digest in sources]
+            for digest in digests:
+                dict_key = md5(
+                    ('%s %s' % (dict_key, digest)).encode()).hexdigest()
+            if cache:
+                # the cache holds the changes from base_key to dict_key
+                cache_key = md5(('%s %s' % (
+                    base_key, ' '.join(digests))).encode()).hexdigest()
+                cache_file = os.path.join(
+                    self.get_cache_dir(), "jieba.user.%s.cache" % cache_key)
                 try:
-                    line = line.decode('utf-8').lstrip('\ufeff')
-                except UnicodeDecodeError:
-                    raise ValueError('dictionary file %s must be utf-8' % f_name)
-            if not line:
-                continue
-            # match won't be None because there's at least one character
-            word, freq, tag = re_userdict.match(line).groups()
-            if freq is not None:
-                freq = freq.strip()
-            if tag is not None:
-                tag = tag.strip()
-            self.add_word(word, freq, tag)
+                    with open(cache_file, 'rb') as cf:
+                        delta, total, tags = marshal.loads(cf.read())
+                except Exception:
+                    pass
+                else:
+                    default_logger.debug("Loaded user dict %s from cache %s" % (
+                        ', '.join(f_name for f_name, _, _ in sources), cache_file))
+                    draft = self._draft(state)
+                    draft.freq.update(delta)
+                    draft.tags.update(tags)
+                    return draft._replace(total=total), dict_key
+        entries = [entry for f_name, lines, _ in sources
+                   for entry in _read_userdict(lines, f_name)]
+        # one copy of the dictionary for all the files
+        draft = self._add_words(self._draft(state), entries)
+        if cache_file is not None:
+            # every change went to the overlay of the draft, a copy of the
+            # changes of `state`
+            overlay = draft.freq.overlay
+            old = None
+            if isinstance(state.freq, PrefixDict):
+                old = state.freq.changes()
+            if old:
+                delta = dict((word, freq) for word, freq in iteritems(overlay)
+                             if old.get(word) != freq)
+            else:
+                delta = overlay
+            tags = {}
+            for word, _, tag in entries:
+                if tag:
+                    tags[word] = tag
+            try:
+                fd, fpath = tempfile.mkstemp(dir=self.get_cache_dir())
+                with os.fdopen(fd, 'wb') as temp_cache_file:
+                    marshal.dump((delta, draft.total, tags), temp_cache_file)
+                _replace_file(fpath, cache_file)
+            except Exception:
+                default_logger.exception("Dump cache file failed.")
+        return draft, dict_key
 
     def add_word(self, word, freq=None, tag=None):
         """
         Add a word to dictionary.
         freq and tag can be omitted, freq defaults to be a calculated value
         that ensures the word can be cut out.
+        The word is seen by the calls starting after it returns.
         """
         self.check_initialized()
         word = strdecode(word)
-        freq = int(freq) if freq is not None else self.suggest_freq(word, False)
-        self.FREQ[word] = freq
-        self.total += freq
-        if tag:
-            self.user_word_tag_tab[word] = tag
-        for ch in xrange(len(word)):
-            wfrag = word[:ch + 1]
-            if wfrag not in self.FREQ:
-                self.FREQ[wfrag] = 0
+        with self.lock:
+            state = self.state
+            if freq is None:
+                freq = self._suggest_freqs([word], state)[0]
+            else:
+                freq = int(freq)
+            state = self._with_words(state, [(word, freq, tag)])
+            self.replace_dict(state.freq, state.total, tags=state.tags)
+
+    def _with_words(self, state, entries):
+        """
+        Return a new DictState: `state` with the (word, freq, tag) entries
+        of decoded words and integer freqs added. `state` is left unchanged
+        and the new words are layered over it (see `PrefixDict.with_words`),
+        so a loop of add_word does not copy the dictionary on every call.
+        """
+        FREQ = state.freq
+        if not isinstance(FREQ, PrefixDict):
+            FREQ = PrefixDict(FREQ)
+        total = state.total
+        items = {}
+        tags = []
+        for word, freq, tag in entries:
+            items[word] = freq
+            total += freq
+            if tag:
+                tags.append((word, tag))
+            # the prefixes of a word in the dictionary are in it too
+            for ch in xrange(len(word) - 1, 0, -1):
+                wfrag = word[:ch]
+                if wfrag in items or wfrag in FREQ:
+                    break
+                items[wfrag] = 0
+        return DictState(FREQ.with_words(iteritems(items)), total, None,
+                         _with_tags(state.tags, tags) if tags else state.tags,
+                         None)
+
+    def _add_words(self, draft, entries):
+        """
+        Add many (word, freq, tag) entries of decoded words to the private
+        DictState `draft` returned by `_draft`, in place; return the new
+        one.
+        """
+        FREQ = draft.freq
+        total = draft.total
+        tab = draft.tags
+        for word, freq, tag in entries:
+            if freq is None:
+                freq = self._suggest_freqs(
+                    [word], DictState(FREQ, total, None, tab, None))[0]
+            else:
+                freq = int(freq)
+            FREQ[word] = freq
+            total += freq
+            if tag:
+                tab[word] = tag
+            for ch in xrange(1, len(word)):
+                wfrag = word[:ch]
+                if wfrag not in FREQ:
+                    FREQ[wfrag] = 0
+        return draft._replace(total=total)
 
     def del_word(self, word):
         """
@@ -424,23 +1735,112 @@ class Tokenizer(object):
         set HMM=False.
         """
         self.check_initialized()
-        ftotal = float(self.total)
-        freq = 1
+        if not tune:
+            return self._suggest_freq(segment, self.state)
         if isinstance(segment, string_types):
             word = segment
-            for seg in self.cut(word, HMM=False):
-                freq *= self.FREQ.get(seg, 1) / ftotal
-            freq = max(int(freq * self.total) + 1, self.FREQ.get(word, 1))
+        else:
+            word = ''.join(map(strdecode, segment))
+        with self.lock:
+            freq = self._suggest_freq(segment, self.state)
+            self.add_word(word, freq)
+        return freq
+
+    def suggest_freqs(self, segments, tune=False):
+        """
+        `suggest_freq` for many segments at once.
+        All the frequencies are computed against the same dictionary, so
+        tuning one word does not affect the frequency suggested for the
+        next, and with `tune` they are added in a single update.
+        Returns the list of frequencies.
+        """
+        self.check_initialized()
+        segments = list(segments)
+        if not tune:
+            return self._suggest_freqs(segments, self.state)
+        with self.lock:
+            state = self.state
+            freqs = self._suggest_freqs(segments, state)
+            entries = []
+            for segment, freq in zip(segments, freqs):
+                if isinstance(segment, string_types):
+                    word = strdecode(segment)
+                else:
+                    word = ''.join(map(strdecode, segment))
+                entries.append((word, freq, None))
+            state = self._with_words(state, entries)
+            self.replace_dict(state.freq, state.total, tags=state.tags)
+        return freqs
+
+    def _suggest_freq(self, segment, state):
+        FREQ, total = state[:2]
+        ftotal = float(total)
+        freq = 1
+        if isinstance(segment, string_types):
+            word = strdecode(segment)
+            for seg in self._cut(word, False, False, state):
+                freq *= FREQ.get(seg, 1) / ftotal
+            freq = max(int(freq * total) + 1, FREQ.get(word, 1))
         else:
             segment = tuple(map(strdecode, segment))
             word = ''.join(segment)
             for seg in segment:
-                freq *= self.FREQ.get(seg, 1) / ftotal
-            freq = min(int(freq * self.total), self.FREQ.get(word, 0))
-        if tune:
-            add_word(word, freq)
+                freq *= FREQ.get(seg, 1) / ftotal
+            freq = min(int(freq * total), FREQ.get(word, 0))
         return freq
 
+    def _suggest_freqs(self, segments, state):
+        """
+        Return [_suggest_freq(segment, state) for segment in segments].
+        Words made of Han characters only, the usual case, are cut inline:
+        they are a single block and the per-block machinery of `cut` would
+        dominate.
+        """
+        FREQ, total = state[:2]
+        ftotal = float(total)
+        log_freq = self._log_freq(total)
+        freqs = []
+        for word in segments:
+            m = None
+            if isinstance(word, string_types):
+                word = strdecode(word)
+                m = re_han_cut_all.match(word)
+            if not m or m.end() != len(word):
+                freqs.append(self._suggest_freq(word, state))
+                continue
+            # calc_route(get_DAG_arrays(word)), same arithmetic
+            N = len(word)
+            best = [0.0] * (N + 1)
+            route = [0] * N
+            for idx in xrange(N - 1, -1, -1):
+                prob = None
+                i = idx
+                frag = word[idx]
+                while i < N:
+                    f = FREQ.get(frag)
+                    if f is None:
+                        break
+                    if f:
+                        p = log_freq[f] + best[i + 1]
+                        if prob is None or p >= prob:
+                            prob = p
+                            x = i
+                    i += 1
+                    frag = word[idx:i + 1]
+                if prob is None:
+                    prob = log_freq[0] + best[idx + 1]
+                    x = idx
+                best[idx] = prob
+                route[idx] = x + 1
+            freq = 1
+            x = 0
+            while x < N:
+                y = route[x]
+                freq *= FREQ.get(word[x:y], 1) / ftotal
+                x = y
+            freqs.append(max(int(freq * total) + 1, FREQ.get(word, 1)))
+        return freqs
+
     def tokenize(self, unicode_sentence, mode="default", HMM=True):
         """
         Tokenize a sentence and yields tuples of (word, start, end)
@@ -451,27 +1851,14 @@ class Tokenizer(object):
         """
         if not isinstance(unicode_sentence, text_type):
             raise ValueError("jieba: the input parameter should be unicode.")
-        start = 0
-        if mode == 'default':
-            for w in self.cut(unicode_sentence, HMM=HMM):
-                width = len(w)
-                yield (w, start, start + width)
-                start += width
+        self.check_initialized()
+        state = self.state
+        mode = "default" if mode == "default" else "search"
+        if self._use_result_cache(unicode_sentence):
+            spans = self._cached_offsets(unicode_sentence, mode, HMM, state)
         else:
-            for w in self.cut(unicode_sentence, HMM=HMM):
-                width = len(w)
-                if len(w) > 2:
-                    for i in xrange(len(w) - 1):
-                        gram2 = w[i:i + 2]
-                        if self.FREQ.get(gram2):
-                            yield (gram2, start + i, start + i + 2)
-                if len(w) > 3:
-                    for i in xrange(len(w) - 2):
-                        gram3 = w[i:i + 3]
-                        if self.FREQ.get(gram3):
-                            yield (gram3, start + i, start + i + 3)
-                yield (w, start, start + width)
-                start += width
+            spans = self._offsets(unicode_sentence, mode, HMM, state)
+        return _span_tokens(unicode_sentence, spans)
 
     def set_dictionary(self, dictionary_path):
         with self.lock:
@@ -490,20 +1877,30 @@ dt = Tokenizer()
 
 get_FREQ = lambda k, d=None: dt.FREQ.get(k, d)
 add_word = dt.add_word
+build_automaton = dt.build_automaton
 calc = dt.calc
 cut = dt.cut
 lcut = dt.lcut
+cut_batch = dt.cut_batch
+cut_offsets = dt.cut_offsets
+recut = dt.recut
+cut_stream = dt.cut_stream
 cut_for_search = dt.cut_for_search
 lcut_for_search = dt.lcut_for_search
 del_word = dt.del_word
 get_DAG = dt.get_DAG
 get_dict_file = dt.get_dict_file
 initialize = dt.initialize
+initialize_async = dt.initialize_async
+initialize_in_background = dt.initialize_in_background
+lattice = dt.lattice
 load_userdict = dt.load_userdict
+load_userdicts = dt.load_userdicts
 set_dictionary = dt.set_dictionary
 suggest_freq = dt.suggest_freq
+suggest_freqs = dt.suggest_freqs
 tokenize = dt.tokenize
-user_word_tag_tab = dt.user_word_tag_tab
+user_word_tag_tab = UserWordTags(dt)
 
 
 def _lcut_all(s):
@@ -527,55 +1924,38 @@ def _lcut_for_search_no_hmm(s):
 
 
 def _pcut(sentence, cut_all=False, HMM=True):
-    parts = strdecode(sentence).splitlines(True)
-    if cut_all:
-        result = pool.map(_lcut_all, parts)
-    elif HMM:
-        result = pool.map(_lcut, parts)
-    else:
-        result = pool.map(_lcut_no_hmm, parts)
-    for r in result:
-        for w in r:
-            yield w
+    return pool.cut(sentence, cut_all, HMM)
 
 
 def _pcut_for_search(sentence, HMM=True):
-    parts = strdecode(sentence).splitlines(True)
-    if HMM:
-        result = pool.map(_lcut_for_search, parts)
-    else:
-        result = pool.map(_lcut_for_search_no_hmm, parts)
-    for r in result:
-        for w in r:
-            yield w
+    return pool.cut_for_search(sentence, HMM)
 
 
-def enable_parallel(processnum=None):
+def enable_parallel(processnum=None, chunk_chars=16384, chunksize=1,
+                    startup=None):
     """
-    Change the module's `cut` and `cut_for_search` functions to the
-    parallel version.
-    Note that this only works using dt, custom Tokenizer
-    instances are not supported.
+    Change the module's `cut` and `cut_for_search` functions (and
+    `jieba.posseg.cut`) to the parallel version, see
+    `jieba.parallel.ParallelTokenizer` for the parameters.
+    To run a custom Tokenizer or POSTokenizer in parallel, create a
+    ParallelTokenizer for it instead.
     """
     global pool, dt, cut, cut_for_search
-    from multiprocessing import cpu_count
-    if os.name == 'nt':
-        raise NotImplementedError(
-            "jieba: parallel mode only supports posix system")
-    else:
-        from multiprocessing import Pool
-    dt.check_initialized()
-    if processnum is None:
-        processnum = cpu_count()
-    pool = Pool(processnum)
+    from .parallel import ParallelTokenizer
+    disable_parallel()
+    pool = ParallelTokenizer(dt, processnum, chunk_chars, chunksize, startup)
     cut = _pcut
     cut_for_search = _pcut_for_search
 
 
 def disable_parallel():
-    global pool, dt, cut, cut_for_search
+    global pool, pos_pool, dt, cut, cut_for_search
     if pool:
         pool.close()
         pool = None
+    if pos_pool:
+        pos_pool.close()
+        pos_pool = None
     cut = dt.cut
     cut_for_search = dt.cut_for_search
+
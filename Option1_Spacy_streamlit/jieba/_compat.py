@@ -26,6 +26,7 @@ else:
     text_type = str
     string_types = (str,)
     xrange = range
+    unichr = chr
 
     iterkeys = lambda d: iter(d.keys())
     itervalues = lambda d: iter(d.values())
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Aho-Corasick automaton for full mode.
+
+Full mode (`Tokenizer.cut(cut_all=True)`) only needs every dictionary word
+found in a block, not the weighted DAG accurate mode runs Viterbi over.
+An `Automaton` adds failure links to a `TrieTable`, so one left-to-right
+pass over the block, one transition per character (amortized), reports
+every word ending at each position instead of walking the trie again from
+every start. It is used with compact dictionaries only, whose trie is
+already built.
+"""
+from __future__ import absolute_import, unicode_literals
+from array import array
+from bisect import bisect_left
+from ._compat import *
+
+
+class Automaton(object):
+    """
+    Aho-Corasick automaton over the words of a `TrieTable`.
+
+    The nodes are those of the table. ``fail[n]`` is the node of the
+    longest proper suffix of the text of ``n`` that is in the trie,
+    ``depth[n]`` the length of that text, and ``output[n]`` the deepest
+    node on the failure chain of ``n`` (``n`` included) holding a word of
+    two characters or more, 0 if none: single characters are what full
+    mode falls back on anyway.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        first = table.first
+        chars = table.chars
+        freqs = table.freqs
+        root = table.root_index()
+        size = len(chars)
+        fail = array('i', [0]) * size
+        depth = array('i', [0]) * size
+        output = array('i', [0]) * size
+        # breadth-first: the failure target of a node is shallower, and
+        # so already done
+        for parent in xrange(size):
+            lo = first[parent]
+            hi = first[parent + 1]
+            if lo == hi:
+                continue
+            d = depth[parent] + 1
+            for node in xrange(lo, hi):
+                depth[node] = d
+                if parent:
+                    code = chars[node]
+                    f = fail[parent]
+                    while f:
+                        a = first[f]
+                        b = first[f + 1]
+                        target = bisect_left(chars, code, a, b)
+                        if target < b and chars[target] == code:
+                            break
+                        f = fail[f]
+                    else:
+                        target = root.get(code, 0)
+                    fail[node] = target
+                if freqs[node] and d > 1:
+                    output[node] = node
+                else:
+                    output[node] = output[fail[node]]
+        self.fail = fail
+        self.depth = depth
+        self.output = output
+
+    def __repr__(self):
+        return '<Automaton nodes=%d>' % len(self.fail)
+
+    @property
+    def nbytes(self):
+        return sum(a.itemsize * len(a)
+                   for a in (self.fail, self.depth, self.output))
+
+    def find_words(self, sentence, keys, skip=None):
+        """
+        Append a key for every word of two characters or more in
+        `sentence` to the list `keys`: the word sentence[i:j + 1] gives
+        ``i * (len(sentence) + 1) + j``, so that sorting the keys orders
+        the words by start, then end.
+        The words of the nodes in the set `skip` are left out.
+        """
+        table = self.table
+        first = table.first
+        chars = table.chars
+        root = table.root_index().get
+        fail = self.fail
+        depth = self.depth
+        output = self.output
+        add = keys.append
+        width = len(sentence) + 1
+        node = 0
+        i = 0
+        for ch in sentence:
+            code = ord(ch)
+            while node:
+                lo = first[node]
+                hi = first[node + 1]
+                target = bisect_left(chars, code, lo, hi)
+                if target < hi and chars[target] == code:
+                    node = target
+                    break
+                node = fail[node]
+            else:
+                node = root(code, 0)
+            m = output[node]
+            while m:
+                if skip is None or m not in skip:
+                    add((i - depth[m] + 1) * width + i)
+                m = output[fail[m]]
+            i += 1
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the dictionary updates, and the timing helper of the other
+benchmarks (`jieba.scanner.benchmark`, `jieba.prefixdict.benchmark`,
+`jieba.prune.measure`).
+"""
+from __future__ import absolute_import, unicode_literals
+import time
+import random
+import shutil
+import tempfile
+import threading
+import jieba
+from ._compat import *
+
+
+def best_time(func, repeat):
+    """
+    Call `func()` `repeat` times and return the shortest time it took, in
+    seconds, and what the last call returned.
+    """
+    best = result = None
+    for _ in xrange(repeat):
+        t = time.time()
+        result = func()
+        elapsed = time.time() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def stress_benchmark(readers=8, writes_per_sec=1, seconds=5, dictionary=None,
+                     compact=False):
+    """
+    Cut a text in `readers` threads for `seconds` while another thread
+    changes the dictionary `writes_per_sec` times a second, and return
+    the reader throughput in calls per second, the number of writes and
+    the number of probe sentences cut by no version of the dictionary.
+    Every write flips the frequency of a word of the probe and adds a new
+    word, so a reader seeing half a change would cut the probe otherwise.
+    """
+    tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT,
+                                compact=compact)
+    tokenizer.initialize()
+    text = jieba.scanner.SAMPLE * 10
+    probe = "我如此的過著孤單的生活沒有一個可以真正跟他談話的人"
+    word = "孤單的生活"
+    valid = set()
+    for freq in (10 ** 7, 0):
+        tokenizer.add_word(word, freq)
+        valid.add(tuple(tokenizer.lcut(probe)))
+    stopped = threading.Event()
+    counts = [0] * readers
+    bad = [0]
+    writes = [0]
+
+    def read(i):
+        while not stopped.is_set():
+            tokenizer.lcut(text)
+            if tuple(tokenizer.lcut(probe)) not in valid:
+                bad[0] += 1
+            counts[i] += 1
+
+    def write():
+        freq = 0
+        while not stopped.wait(1.0 / writes_per_sec):
+            freq = 10 ** 7 - freq
+            tokenizer.add_word(word, freq)
+            tokenizer.add_word("stress%d" % writes[0], 3)
+            writes[0] += 1
+
+    threads = [threading.Thread(target=read, args=(i,))
+               for i in xrange(readers)]
+    if writes_per_sec:
+        threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    return {
+        'calls_per_sec': sum(counts) / float(seconds),
+        'writes': writes[0],
+        'inconsistent': bad[0],
+    }
+
+
+def userdict_benchmark(words=100000, dictionary=None, repeat=3):
+    """
+    Add a generated user dictionary of `words` entries (half with a
+    frequency and a tag, 30% with a frequency only, the rest with
+    neither) to the dictionary and return the best time of each way, in
+    seconds: one add_word per line, `load_userdicts` the first time,
+    which also writes the user dict cache, and `load_userdicts` again,
+    reading it.
+    """
+    rng = random.Random(0)
+    dictionary = dictionary or jieba.DEFAULT_DICT
+    tokenizer = jieba.Tokenizer(dictionary)
+    tokenizer.initialize()
+    chars = sorted(w for w, f in iteritems(tokenizer.FREQ)
+                   if len(w) == 1 and f > 1 and
+                   jieba.re_han_char_cut_all.match(w))
+    lines = []
+    for _ in xrange(words):
+        word = ''.join(rng.choice(chars) for _ in xrange(rng.randint(2, 5)))
+        kind = rng.random()
+        if kind < 0.5:
+            line = '%s %d %s' % (word, rng.randint(1, 1000),
+                                 rng.choice(('n', 'nr', 'ns', 'v', 'nz')))
+        elif kind < 0.8:
+            line = '%s %d' % (word, rng.randint(1, 1000))
+        else:
+            line = word
+        lines.append(line)
+
+    def add_words(tokenizer):
+        for word, freq, tag in jieba._read_userdict(lines, 'benchmark'):
+            tokenizer.add_word(word, freq, tag)
+
+    def load_userdicts(tokenizer):
+        tokenizer.load_userdicts([lines])
+
+    def run(load, cache_dir):
+        tokenizer = jieba.Tokenizer(dictionary)
+        tokenizer.initialize()
+        tokenizer.tmp_dir = cache_dir
+        t = time.time()
+        load(tokenizer)
+        return time.time() - t
+
+    times = {}
+    for _ in xrange(repeat):
+        # the first load_userdicts writes the cache the second one reads
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for name, load in (('add_word', add_words),
+                               ('load_userdicts', load_userdicts),
+                               ('load_userdicts_cached', load_userdicts)):
+                times.setdefault(name, []).append(run(load, cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+    return dict((name, min(t)) for name, t in iteritems(times))
@@ -0,0 +1,96 @@
+"""
+Compile a dictionary ahead of time, see `jieba.compiled`.
+
+    python -m jieba.compile [-D DICT] [-u USER_DICT]... [-o OUTPUT]
+
+Without -o, the result is written next to the dictionary as
+``<dictionary>.compiled``, where tokenizers using that dictionary pick it up.
+With -u, -o is required: the user words would otherwise be added to every
+tokenizer of the dictionary.
+"""
+import os
+import sys
+import time
+import tempfile
+import jieba
+from argparse import ArgumentParser
+from . import compiled
+from ._compat import *
+
+
+def compile_dict(output=None, dictionary=None, user_dicts=()):
+    """
+    Compile `dictionary` (the bundled dict.txt by default) with the words of
+    `user_dicts` added as `Tokenizer.load_userdicts` would, and write it to
+    `output`. Returns the path written.
+    `output` may only be omitted without `user_dicts`: tokenizers pick
+    ``<dictionary>.compiled`` up in place of the dictionary alone.
+    """
+    tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT)
+    if output is None:
+        if user_dicts:
+            raise ValueError(
+                "jieba: an output path is needed to compile user dicts")
+        if tokenizer.dictionary == jieba.DEFAULT_DICT:
+            output = os.path.join(os.path.dirname(os.path.abspath(
+                jieba.__file__)), jieba.DEFAULT_DICT_NAME)
+        else:
+            output = tokenizer.dictionary
+        output += compiled.COMPILED_SUFFIX
+    source_key = tokenizer._dict_hash()
+    FREQ, total = tokenizer.gen_pfdict(tokenizer.get_dict_file())
+    tokenizer.replace_dict(FREQ, total, source_key)
+    tokenizer.initialized = True
+    if user_dicts:
+        tokenizer.load_userdicts(user_dicts)
+        FREQ = dict(tokenizer.FREQ)
+    from . import posseg
+    tags = posseg.POSTokenizer(tokenizer, {})
+    tags.load_word_tag(tokenizer.get_dict_file())
+    tags = dict(tags.word_tag_tab)
+    tags.update(tokenizer.state.tags)
+    # written aside and renamed, so that running processes never see a
+    # partial file
+    fd, fpath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            compiled.dump(f, FREQ, tokenizer.total, tags, source_key,
+                          tokenizer.dict_key)
+        # mkstemp creates it readable by its owner only
+        os.chmod(fpath, 0o644)
+        jieba._replace_file(fpath, output)
+    except Exception:
+        os.remove(fpath)
+        raise
+    return output
+
+
+def main():
+    parser = ArgumentParser(
+        usage="%s -m jieba.compile [options]" % sys.executable,
+        description="Compile a dictionary and its POS tags into one file "
+                    "that tokenizers load without parsing it.")
+    parser.add_argument("-D", "--dict",
+                        help="compile DICT instead of the default dictionary")
+    parser.add_argument("-u", "--user-dict", action="append", default=[],
+                        help="add the words of USER_DICT; may be repeated, "
+                             "requires -o")
+    parser.add_argument("-o", "--output",
+                        help="write to OUTPUT instead of <dictionary>.compiled")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False,
+                        help="don't print loading messages to stderr")
+    args = parser.parse_args()
+    if args.user_dict and not args.output:
+        parser.error("-u/--user-dict requires -o/--output")
+
+    if args.quiet:
+        jieba.setLogLevel(60)
+    t1 = time.time()
+    output = compile_dict(args.output, args.dict, args.user_dict)
+    if not args.quiet:
+        sys.stderr.write("Compiled %s (%d bytes) in %.3f seconds.\n" % (
+            output, os.path.getsize(output), time.time() - t1))
+
+
+if __name__ == '__main__':
+    main()
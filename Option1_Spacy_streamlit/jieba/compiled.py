@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled dictionaries, built ahead of time by ``python -m jieba.compile``.
+
+A compiled dictionary holds everything `Tokenizer` and `POSTokenizer` would
+otherwise parse from the dictionary file (and the user dictionaries compiled
+in) when a process starts:
+
+- the prefix dict as a `TrieTable`, mapped in place in compact mode,
+- the same prefix dict marshalled, for the default dict mode,
+- the POS tag of every word.
+
+A tokenizer uses ``<dictionary>.compiled`` (``jieba/dict.txt.compiled`` for
+the bundled dictionary) instead of the file cache in the temp directory
+when it was compiled from the same dictionary content, or the compiled file
+given as its dictionary. Nothing is written at startup.
+"""
+from __future__ import absolute_import, unicode_literals
+import mmap
+import marshal
+import struct
+from io import BytesIO
+from ._compat import *
+from .prefixdict import PrefixDict, TrieTable
+
+# magic (format version), byte order mark, total frequency, md5 of the
+# dictionary file, content key of the dictionary and user dictionaries
+# (`Tokenizer.dict_key`), then (offset, length) of each section
+MAGIC = b'JBCDICT1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIQ32s32s6Q')
+SECTIONS = ('table', 'freq', 'tags')
+# sections start on a multiple of 8 bytes
+ALIGN = 8
+
+COMPILED_SUFFIX = '.compiled'
+
+
+def is_compiled(path):
+    """Tell whether `path` is a compiled dictionary."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def dump(f, FREQ, total, tags, source_key, dict_key):
+    """
+    Write a compiled dictionary to the binary file object `f`.
+    Parameter:
+        - FREQ: The prefix dict, a plain dict.
+        - total: The total frequency.
+        - tags: word -> POS tag.
+        - source_key: md5 hex digest of the dictionary file.
+        - dict_key: `Tokenizer.dict_key` after loading the user
+                    dictionaries compiled in.
+    """
+    table = BytesIO()
+    TrieTable.from_items(iteritems(FREQ)).dump(table, total)
+    sections = [table.getvalue(), marshal.dumps(FREQ), marshal.dumps(tags)]
+    offsets = []
+    offset = HEADER.size
+    for data in sections:
+        offset += -offset % ALIGN
+        offsets.extend((offset, len(data)))
+        offset += len(data)
+    f.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, total,
+                        source_key.encode('ascii'), dict_key.encode('ascii'),
+                        *offsets))
+    offset = HEADER.size
+    for data in sections:
+        f.write(b'\0' * (-offset % ALIGN))
+        offset += -offset % ALIGN + len(data)
+        f.write(data)
+
+
+class CompiledDict(object):
+    """
+    A compiled dictionary, mapped read-only.
+    Raises ValueError if `path` is not a compiled dictionary of this
+    version and platform.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except ValueError:
+            self.buf.close()
+            raise
+
+    def _read_header(self):
+        buf = self.buf
+        if len(buf) < HEADER.size:
+            raise ValueError('truncated compiled dictionary')
+        fields = HEADER.unpack_from(buf)
+        magic, bom, self.total, source_key, dict_key = fields[:5]
+        if magic != MAGIC or bom != BYTE_ORDER_MARK:
+            raise ValueError(
+                'not a compiled dictionary of this version/platform')
+        self.source_key = source_key.decode('ascii')
+        self.dict_key = dict_key.decode('ascii')
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = fields[5 + 2 * i:7 + 2 * i]
+            if offset + length > len(buf):
+                raise ValueError('truncated compiled dictionary')
+            self.sections[name] = (offset, length)
+
+    def __repr__(self):
+        return '<CompiledDict %r>' % self.path
+
+    def section(self, name):
+        """Return a memoryview of the section `name`, without copying it."""
+        offset, length = self.sections[name]
+        return memoryview(self.buf)[offset:offset + length]
+
+    def load(self, compact):
+        """Return (FREQ, total) as `Tokenizer.initialize` would build them."""
+        if compact:
+            table, total = TrieTable.frombuffer(self.section('table'))
+            return PrefixDict(table), total
+        return marshal.loads(self.section('freq')), self.total
+
+    def word_tags(self):
+        """Return a dict of word -> POS tag."""
+        return marshal.loads(self.section('tags'))
@@ -4,6 +4,8 @@ import os
 import sys
 import pickle
 from .._compat import *
+from .. import scanner
+from ..scanner import BLOCK
 
 MIN_FLOAT = -3.14e100
 
@@ -74,19 +76,18 @@ def __cut(sentence):
     if nexti < len(sentence):
         yield sentence[nexti:]
 
+# blocks are split with scanner.FINALSEG, these are kept for the code
+# using them
 re_han = re.compile("([\u4E00-\u9FD5]+)")
-re_skip = re.compile("(\d+\.\d+|[a-zA-Z0-9]+)")
+re_skip = re.compile(r"(\d+\.\d+|[a-zA-Z0-9]+)")
 
 
 def cut(sentence):
     sentence = strdecode(sentence)
-    blocks = re_han.split(sentence)
-    for blk in blocks:
-        if re_han.match(blk):
-            for word in __cut(blk):
+    kinds = scanner.FINALSEG.kinds
+    for m in scanner.FINALSEG.finditer(sentence):
+        if kinds[m.lastindex] is BLOCK:
+            for word in __cut(m.group()):
                 yield word
         else:
-            tmp = re_skip.split(blk)
-            for x in tmp:
-                if x:
-                    yield x
+            yield m.group()
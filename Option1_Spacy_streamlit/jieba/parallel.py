@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel segmentation for any Tokenizer or POSTokenizer instance.
+
+Workers get the tokenizer in one of two ways:
+
+- "fork": they inherit it from the parent. Everything alive is moved to
+  the permanent GC generation with `gc.freeze()` just before forking, so
+  the collector never writes to the dictionary and HMM tables and their
+  pages stay shared copy-on-write. The parent unfreezes them afterwards,
+  unless something was frozen already: the permanent generation can only
+  be thawed as a whole.
+- "snapshot": the parent writes its current prefix dict (user words
+  included) and POS tags to a snapshot directory once, and workers load
+  it from there instead of receiving a pickled copy. Compact dictionaries
+  are memory-mapped, so their pages are shared too. This is the only mode
+  available where processes are not forked.
+
+Input is split at sentence punctuation into pieces of about `chunk_chars`
+characters, so a single long line is spread over all workers too, and
+results come back in order through `imap`.
+"""
+from __future__ import absolute_import, unicode_literals
+import os
+import re
+import gc
+import shutil
+import marshal
+import tempfile
+import threading
+from functools import partial
+import jieba
+from ._compat import *
+from .prefixdict import PrefixDict, TrieTable
+
+re_sentence_end = re.compile('[。！？；!?;\n]')
+
+SNAPSHOT_FREQ = 'freq'
+SNAPSHOT_TAGS = 'tags'
+
+# the tokenizer of a pool worker, set by _init_worker or _init_forked
+_worker = None
+
+
+def split_balanced(sentence, size, is_boundary=jieba._is_boundary):
+    """
+    Split `sentence` into pieces of about `size` characters, preferably
+    right after sentence punctuation and always where `is_boundary` allows.
+    """
+    pieces = []
+    pos = 0
+    N = len(sentence)
+    while N - pos > size:
+        end = pos + size
+        m = re_sentence_end.search(sentence, end, end + size // 2)
+        if m and is_boundary(sentence, m.end()):
+            end = m.end()
+        else:
+            while not is_boundary(sentence, end):
+                end += 1
+        pieces.append(sentence[pos:end])
+        pos = end
+    if pos < N:
+        pieces.append(sentence[pos:])
+    return pieces
+
+
+def write_snapshot(tokenizer, dirname):
+    """Save the dictionary state of a Tokenizer or POSTokenizer."""
+    pos = hasattr(tokenizer, 'word_tag_tab')
+    if pos:
+        tokenizer.makesure_userdict_loaded()
+        tok = tokenizer.tokenizer
+    else:
+        tok = tokenizer
+    tok.check_initialized()
+    state = tok.state
+    FREQ, total = state.freq, state.total
+    with open(os.path.join(dirname, SNAPSHOT_FREQ), 'wb') as f:
+        if tok.compact:
+            if FREQ.overlay or FREQ.recent:
+                table = TrieTable.from_items(FREQ.iteritems())
+            else:
+                table = FREQ.base
+            table.dump(f, total)
+        else:
+            if isinstance(FREQ, PrefixDict):
+                merged = FREQ.base.copy()
+                merged.update(FREQ.changes())
+                FREQ = merged
+            marshal.dump((FREQ, total), f)
+    with open(os.path.join(dirname, SNAPSHOT_TAGS), 'wb') as f:
+        # marshal only takes plain dicts, not WordTagTable or LayeredDict
+        marshal.dump((dict(state.tags),
+                      dict(tokenizer.word_tag_tab) if pos else None), f)
+
+
+def load_snapshot(dirname, compact):
+    """Rebuild the tokenizer saved by `write_snapshot`."""
+    tok = jieba.Tokenizer(compact=compact)
+    with open(os.path.join(dirname, SNAPSHOT_TAGS), 'rb') as f:
+        user_tags, word_tag_tab = marshal.loads(f.read())
+    path = os.path.join(dirname, SNAPSHOT_FREQ)
+    if compact:
+        table, total = TrieTable.load(path)
+        tok.replace_dict(PrefixDict(table), total, tags=user_tags)
+    else:
+        with open(path, 'rb') as f:
+            FREQ, total = marshal.loads(f.read())
+        tok.replace_dict(FREQ, total, tags=user_tags)
+    tok.initialized = True
+    if word_tag_tab is None:
+        return tok
+    from . import posseg
+    return posseg.POSTokenizer(tok, word_tag_tab)
+
+
+def process_memory(pid):
+    """
+    Return (rss, uss) of a process in bytes, uss being the memory no other
+    process shares. Linux only.
+    """
+    try:
+        f = open('/proc/%d/smaps_rollup' % pid)
+    except IOError:
+        f = open('/proc/%d/smaps' % pid)
+    rss = uss = 0
+    with f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key == 'Rss':
+                rss += int(value.split()[0]) * 1024
+            elif key in ('Private_Clean', 'Private_Dirty'):
+                uss += int(value.split()[0]) * 1024
+    return rss, uss
+
+
+def _init_worker(dirname, compact):
+    global _worker
+    _worker = load_snapshot(dirname, compact)
+
+
+def _init_forked(tokenizer):
+    global _worker
+    _worker = tokenizer
+
+
+def _lcut(sentence, cut_all, HMM):
+    return _worker.lcut(sentence, cut_all, HMM)
+
+
+def _lcut_pos(sentence, HMM):
+    return _worker.lcut(sentence, HMM)
+
+
+def _lcut_for_search(sentence, HMM):
+    return _worker.lcut_for_search(sentence, HMM)
+
+
+class ParallelTokenizer(object):
+    """
+    Run the segmentation of `tokenizer` (a Tokenizer or POSTokenizer,
+    custom dictionaries and user words included) in a process pool.
+    Parameter:
+        - processnum: Number of worker processes, defaults to cpu_count().
+        - chunk_chars: Approximate size of the pieces sent to workers, at
+                       least 1.
+        - chunksize: Number of pieces sent to a worker at a time.
+        - startup: "fork" or "snapshot", see the module documentation.
+                   Defaults to "fork" where it is the start method.
+
+    Workers hold a copy of the dictionary taken when they start. When the
+    dictionary of `tokenizer` changes afterwards (add_word, load_userdict,
+    a `jieba.watch.UserDictWatcher` reload...), the next call waits for
+    the running ones and restarts the pool, so it costs a full startup.
+    """
+
+    def __init__(self, tokenizer=None, processnum=None, chunk_chars=16384,
+                 chunksize=1, startup=None):
+        if os.name == 'nt':
+            raise NotImplementedError(
+                "jieba: parallel mode only supports posix system")
+        if chunk_chars <= 0:
+            raise ValueError("jieba: chunk_chars must be positive")
+        import multiprocessing
+        self.tokenizer = tokenizer or jieba.dt
+        self.pos = hasattr(self.tokenizer, 'word_tag_tab')
+        self.base = self.tokenizer.tokenizer if self.pos else self.tokenizer
+        self.base.check_initialized()
+        self.processnum = processnum or multiprocessing.cpu_count()
+        self.chunk_chars = chunk_chars
+        self.chunksize = chunksize
+        if startup is None:
+            if multiprocessing.get_start_method() == 'fork':
+                startup = 'fork'
+            else:
+                startup = 'snapshot'
+        if startup not in ('fork', 'snapshot'):
+            raise ValueError("jieba: unknown startup mode %r" % startup)
+        self.startup = startup
+        self.snapshot = None
+        self.pool = None
+        # the DictState version the workers were started with
+        self.version = None
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        import multiprocessing
+        base = self.base
+        # taken first: a change made while starting restarts the pool
+        self.version = base.state.version
+        if self.startup == 'fork':
+            if self.pos:
+                self.tokenizer.makesure_userdict_loaded()
+            else:
+                # shared by the workers rather than built by each
+                base.build_automaton()
+            # gc.freeze() is new in Python 3.7
+            freeze = getattr(gc, 'freeze', None)
+            if freeze:
+                # gc.unfreeze() thaws everything, so a freeze made by the
+                # application, e.g. a pre-fork server, is left as it is
+                thaw = not gc.get_freeze_count()
+                gc.collect()
+                freeze()
+            try:
+                self.pool = multiprocessing.get_context('fork').Pool(
+                    self.processnum, _init_forked, (self.tokenizer,))
+            finally:
+                if freeze and thaw:
+                    gc.unfreeze()
+        else:
+            self.snapshot = tempfile.mkdtemp(prefix='jieba.')
+            try:
+                write_snapshot(self.tokenizer, self.snapshot)
+                self.pool = multiprocessing.Pool(
+                    self.processnum, _init_worker,
+                    (self.snapshot, base.compact))
+            except Exception:
+                shutil.rmtree(self.snapshot, True)
+                self.snapshot = None
+                raise
+
+    def _stop(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.snapshot:
+            shutil.rmtree(self.snapshot, True)
+            self.snapshot = None
+
+    def _current_pool(self):
+        """Return the pool, restarted first if the dictionary changed."""
+        if self.base.state.version != self.version:
+            with self.lock:
+                if self.pool is None:
+                    raise ValueError("jieba: ParallelTokenizer is closed")
+                if self.base.state.version != self.version:
+                    jieba.default_logger.debug(
+                        "Dictionary changed, restarting the workers")
+                    self._stop()
+                    self._start()
+        return self.pool
+
+    def __repr__(self):
+        return '<ParallelTokenizer tokenizer=%r processnum=%d startup=%s>' % (
+            self.tokenizer, self.processnum, self.startup)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _map(self, func, sentence, cut_all=False):
+        if cut_all:
+            is_boundary = jieba._is_boundary_cut_all
+        else:
+            is_boundary = jieba._is_boundary
+        pieces = split_balanced(
+            strdecode(sentence), self.chunk_chars, is_boundary)
+        pool = self._current_pool()
+        for words in pool.imap(func, pieces, self.chunksize):
+            for w in words:
+                yield w
+
+    def cut(self, sentence, cut_all=False, HMM=True):
+        if self.pos:
+            if cut_all:
+                raise TypeError("jieba: POSTokenizer has no cut_all mode")
+            return self._map(partial(_lcut_pos, HMM=HMM), sentence)
+        return self._map(partial(_lcut, cut_all=cut_all, HMM=HMM),
+                         sentence, cut_all)
+
+    def cut_for_search(self, sentence, HMM=True):
+        if self.pos:
+            raise TypeError("jieba: POSTokenizer has no cut_for_search")
+        return self._map(partial(_lcut_for_search, HMM=HMM), sentence)
+
+    def lcut(self, *args, **kwargs):
+        return list(self.cut(*args, **kwargs))
+
+    def lcut_for_search(self, *args, **kwargs):
+        return list(self.cut_for_search(*args, **kwargs))
+
+    def memory_usage(self):
+        """Return {pid: (rss, uss)} for the workers, see `process_memory`."""
+        # Pool keeps no public list of its processes
+        return dict((p.pid, process_memory(p.pid)) for p in self.pool._pool)
+
+    def close(self):
+        with self.lock:
+            self._stop()
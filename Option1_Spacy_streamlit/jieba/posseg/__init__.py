@@ -4,7 +4,10 @@ import re
 import sys
 import jieba
 import pickle
+import weakref
 from .._compat import *
+from .. import scanner
+from ..scanner import BLOCK
 from .viterbi import viterbi
 
 PROB_START_P = "prob_start.p"
@@ -12,16 +15,25 @@ PROB_TRANS_P = "prob_trans.p"
 PROB_EMIT_P = "prob_emit.p"
 CHAR_STATE_TAB_P = "char_state_tab.p"
 
+# blocks are split with scanner.DETAIL and scanner.DEFAULT, these are
+# kept for the code using them
 re_han_detail = re.compile("([\u4E00-\u9FD5]+)")
-re_skip_detail = re.compile("([\.0-9]+|[a-zA-Z0-9]+)")
-re_han_internal = re.compile("([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)")
-re_skip_internal = re.compile("(\r\n|\s)")
+re_skip_detail = re.compile(r"([\.0-9]+|[a-zA-Z0-9]+)")
+re_han_internal = re.compile(r"([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)")
+re_skip_internal = re.compile(r"(\r\n|\s)")
 
 re_eng = re.compile("[a-zA-Z0-9]+")
-re_num = re.compile("[\.0-9]+")
+re_num = re.compile(r"[\.0-9]+")
 
 re_eng1 = re.compile('^[a-zA-Z0-9]$', re.U)
 
+# the WordTagTable of every dictionary file in use, by (path, mtime)
+WORD_TAG_TABS = weakref.WeakValueDictionary()
+
+
+class WordTagTable(dict):
+    """Word -> POS tag, read-only once loaded and shared between POSTokenizers."""
+
 
 def load_model():
     # For Jython
@@ -77,9 +89,12 @@ class pair(object):
 
 class POSTokenizer(object):
 
-    def __init__(self, tokenizer=None):
+    def __init__(self, tokenizer=None, word_tag_tab=None):
         self.tokenizer = tokenizer or jieba.Tokenizer()
-        self.load_word_tag(self.tokenizer.get_dict_file())
+        if word_tag_tab is None:
+            self.load_shared_word_tag()
+        else:
+            self.word_tag_tab = word_tag_tab
 
     def __repr__(self):
         return '<POSTokenizer tokenizer=%r>' % self.tokenizer
@@ -92,10 +107,29 @@ class POSTokenizer(object):
 
     def initialize(self, dictionary=None):
         self.tokenizer.initialize(dictionary)
-        self.load_word_tag(self.tokenizer.get_dict_file())
+        self.load_shared_word_tag()
+
+    def load_shared_word_tag(self):
+        """Load the tags of the tokenizer's dictionary, or share them."""
+        compiled = self.tokenizer.get_compiled_dict()
+        if compiled is not None:
+            key = (compiled.path, compiled.dict_key)
+        else:
+            key = self.tokenizer.dictionary
+            if key is not None:
+                key = (key, os.path.getmtime(key))
+        tab = WORD_TAG_TABS.get(key)
+        if tab is not None:
+            self.word_tag_tab = tab
+            return
+        if compiled is not None:
+            self.word_tag_tab = WordTagTable(compiled.word_tags())
+        else:
+            self.load_word_tag(self.tokenizer.get_dict_file())
+        WORD_TAG_TABS[key] = self.word_tag_tab
 
     def load_word_tag(self, f):
-        self.word_tag_tab = {}
+        self.word_tag_tab = WordTagTable()
         f_name = resolve_filename(f)
         for lineno, line in enumerate(f, 1):
             try:
@@ -110,9 +144,21 @@ class POSTokenizer(object):
         f.close()
 
     def makesure_userdict_loaded(self):
-        if self.tokenizer.user_word_tag_tab:
-            self.word_tag_tab.update(self.tokenizer.user_word_tag_tab)
-            self.tokenizer.user_word_tag_tab = {}
+        # user tags are looked up in the tokenizer, see word_tag
+        pass
+
+    def word_tag(self, word, state=None):
+        """
+        Return the tag of `word`, the one given by a user dict first.
+        `state` is the DictState of the tokenizer to look the user tags up
+        in, the current one by default.
+        """
+        if state is None:
+            state = self.tokenizer.state
+        tag = state.tags.get(word)
+        if tag is None:
+            return self.word_tag_tab.get(word, 'x')
+        return tag
 
     def __cut(self, sentence):
         prob, pos_list = viterbi(
@@ -133,31 +179,23 @@ class POSTokenizer(object):
             yield pair(sentence[nexti:], pos_list[nexti][1])
 
     def __cut_detail(self, sentence):
-        blocks = re_han_detail.split(sentence)
-        for blk in blocks:
-            if re_han_detail.match(blk):
-                for word in self.__cut(blk):
+        tags = scanner.DETAIL.kinds
+        for m in scanner.DETAIL.finditer(sentence):
+            tag = tags[m.lastindex]
+            if tag is BLOCK:
+                for word in self.__cut(m.group()):
                     yield word
             else:
-                tmp = re_skip_detail.split(blk)
-                for x in tmp:
-                    if x:
-                        if re_num.match(x):
-                            yield pair(x, 'm')
-                        elif re_eng.match(x):
-                            yield pair(x, 'eng')
-                        else:
-                            yield pair(x, 'x')
-
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
-        self.tokenizer.calc(sentence, DAG, route)
+                yield pair(m.group(), tag)
+
+    def __cut_DAG_NO_HMM(self, sentence, state):
+        route = self.tokenizer.calc_route(
+            self.tokenizer.get_DAG_arrays(sentence, state))
         x = 0
         N = len(sentence)
         buf = ''
         while x < N:
-            y = route[x][1] + 1
+            y = route[x]
             l_word = sentence[x:y]
             if re_eng1.match(l_word):
                 buf += l_word
@@ -166,78 +204,70 @@ class POSTokenizer(object):
                 if buf:
                     yield pair(buf, 'eng')
                     buf = ''
-                yield pair(l_word, self.word_tag_tab.get(l_word, 'x'))
+                yield pair(l_word, self.word_tag(l_word, state))
                 x = y
         if buf:
             yield pair(buf, 'eng')
             buf = ''
 
-    def __cut_DAG(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
-
-        self.tokenizer.calc(sentence, DAG, route)
+    def __cut_DAG(self, sentence, state):
+        FREQ = state.freq
+        route = self.tokenizer.calc_route(
+            self.tokenizer.get_DAG_arrays(sentence, state))
 
         x = 0
         buf = ''
         N = len(sentence)
         while x < N:
-            y = route[x][1] + 1
+            y = route[x]
             l_word = sentence[x:y]
             if y - x == 1:
                 buf += l_word
             else:
                 if buf:
                     if len(buf) == 1:
-                        yield pair(buf, self.word_tag_tab.get(buf, 'x'))
-                    elif not self.tokenizer.FREQ.get(buf):
+                        yield pair(buf, self.word_tag(buf, state))
+                    elif not FREQ.get(buf):
                         recognized = self.__cut_detail(buf)
                         for t in recognized:
                             yield t
                     else:
                         for elem in buf:
-                            yield pair(elem, self.word_tag_tab.get(elem, 'x'))
+                            yield pair(elem, self.word_tag(elem, state))
                     buf = ''
-                yield pair(l_word, self.word_tag_tab.get(l_word, 'x'))
+                yield pair(l_word, self.word_tag(l_word, state))
             x = y
 
         if buf:
             if len(buf) == 1:
-                yield pair(buf, self.word_tag_tab.get(buf, 'x'))
-            elif not self.tokenizer.FREQ.get(buf):
+                yield pair(buf, self.word_tag(buf, state))
+            elif not FREQ.get(buf):
                 recognized = self.__cut_detail(buf)
                 for t in recognized:
                     yield t
             else:
                 for elem in buf:
-                    yield pair(elem, self.word_tag_tab.get(elem, 'x'))
+                    yield pair(elem, self.word_tag(elem, state))
 
     def __cut_internal(self, sentence, HMM=True):
         self.makesure_userdict_loaded()
         sentence = strdecode(sentence)
-        blocks = re_han_internal.split(sentence)
+        self.tokenizer.check_initialized()
+        # one dictionary version for the whole sentence
+        state = self.tokenizer.state
         if HMM:
             cut_blk = self.__cut_DAG
         else:
             cut_blk = self.__cut_DAG_NO_HMM
 
-        for blk in blocks:
-            if re_han_internal.match(blk):
-                for word in cut_blk(blk):
+        kinds = scanner.DEFAULT.kinds
+        for m in scanner.DEFAULT.finditer(sentence):
+            if kinds[m.lastindex] is BLOCK:
+                for word in cut_blk(m.group(), state):
                     yield word
             else:
-                tmp = re_skip_internal.split(blk)
-                for x in tmp:
-                    if re_skip_internal.match(x):
-                        yield pair(x, 'x')
-                    else:
-                        for xx in x:
-                            if re_num.match(xx):
-                                yield pair(xx, 'm')
-                            elif re_eng.match(x):
-                                yield pair(xx, 'eng')
-                            else:
-                                yield pair(xx, 'x')
+                # digits and latin letters are always in blocks
+                yield pair(m.group(), 'x')
 
     def _lcut_internal(self, sentence):
         return list(self.__cut_internal(sentence))
@@ -252,6 +282,19 @@ class POSTokenizer(object):
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
 
+    def cut_stream(self, source, chunk_chars=65536, HMM=True):
+        """
+        Tag a text too large to hold in memory, see `Tokenizer.cut_stream`.
+        """
+        if chunk_chars <= 0:
+            raise ValueError("jieba: chunk_chars must be positive")
+        return self._cut_stream(source, chunk_chars, HMM)
+
+    def _cut_stream(self, source, chunk_chars, HMM):
+        for chunk in jieba._stream_chunks(source, chunk_chars):
+            for w in self.cut(chunk, HMM=HMM):
+                yield w
+
 # default Tokenizer instance
 
 dt = POSTokenizer(jieba.dt)
@@ -273,21 +316,20 @@ def cut(sentence, HMM=True):
     """
     Global `cut` function that supports parallel processing.
     Note that this only works using dt, custom POSTokenizer
-    instances are not supported.
+    instances can be run with `jieba.parallel.ParallelTokenizer`.
     """
     global dt
     if jieba.pool is None:
         for w in dt.cut(sentence, HMM=HMM):
             yield w
     else:
-        parts = strdecode(sentence).splitlines(True)
-        if HMM:
-            result = jieba.pool.map(_lcut_internal, parts)
-        else:
-            result = jieba.pool.map(_lcut_internal_no_hmm, parts)
-        for r in result:
-            for w in r:
-                yield w
+        if jieba.pos_pool is None:
+            from ..parallel import ParallelTokenizer
+            jieba.pos_pool = ParallelTokenizer(
+                dt, jieba.pool.processnum, jieba.pool.chunk_chars,
+                jieba.pool.chunksize, jieba.pool.startup)
+        for w in jieba.pos_pool.cut(sentence, HMM=HMM):
+            yield w
 
 
 def lcut(sentence, HMM=True):
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""
+Compact prefix dictionary for jieba.
+
+The default `Tokenizer.FREQ` is a dict holding every word of the dictionary
+plus every prefix of every word with frequency 0. `TrieTable` stores the same
+information as three flat integer arrays laid out as a breadth-first trie,
+and `PrefixDict` puts a small mutable overlay in front of it (or of a plain
+dict shared between tokenizers) so that it can be used wherever `FREQ` is
+expected.
+
+The table can be saved with `TrieTable.dump` and mapped back read-only with
+`TrieTable.load`, which queries the arrays in place: processes loading the
+same file share one page-cache copy instead of each unpickling its own.
+
+`memory_report()` compares the size of both representations and
+`benchmark()` the speed of building DAGs with each.
+"""
+from __future__ import absolute_import, unicode_literals
+import sys
+import mmap
+import random
+import struct
+from array import array
+from bisect import bisect_left
+from collections import deque
+from ._compat import *
+from .automaton import Automaton
+
+# magic (format version), byte order mark, node count, total frequency
+MAGIC = b'JBPFDIC1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIIQ')
+
+
+class TrieTable(object):
+    """
+    Immutable breadth-first trie.
+
+    Node 0 is the root. The children of node ``n`` are the nodes
+    ``first[n]`` .. ``first[n + 1] - 1``, sorted by ``chars``, which holds the
+    code point of the edge leading to each node. ``freqs`` holds the word
+    frequency of each node, 0 for pure prefixes.
+    """
+
+    def __init__(self, first, chars, freqs):
+        self.first = first
+        self.chars = chars
+        self.freqs = freqs
+        self._root_index = None
+        self._automaton = None
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Build a table from (word, freq) pairs. Prefixes are implied and do
+        not need to be listed; words with freq 0 only keep their prefix.
+        """
+        words = sorted((w, f) for w, f in items if w)
+        first = array('I')
+        chars = array('I', [0])
+        freqs = array('I', [0])
+        queue = deque([(0, len(words), 0)])
+        size = 1
+        while queue:
+            lo, hi, depth = queue.popleft()
+            first.append(size)
+            if lo < hi and len(words[lo][0]) == depth:
+                lo += 1
+            while lo < hi:
+                ch = words[lo][0][depth]
+                end = lo + 1
+                while end < hi and words[end][0][depth] == ch:
+                    end += 1
+                chars.append(ord(ch))
+                if len(words[lo][0]) == depth + 1:
+                    freqs.append(words[lo][1])
+                else:
+                    freqs.append(0)
+                queue.append((lo, end, depth + 1))
+                size += 1
+                lo = end
+        first.append(size)
+        return cls(first, chars, freqs)
+
+    def child(self, node, code):
+        """Return the child of `node` reached by code point `code`, or -1."""
+        lo = self.first[node]
+        hi = self.first[node + 1]
+        i = bisect_left(self.chars, code, lo, hi)
+        if i < hi and self.chars[i] == code:
+            return i
+        return -1
+
+    def root_index(self):
+        """
+        Return a dict of code point -> node for the children of the root,
+        the widest node of the trie, to start walks without a bisection.
+        """
+        index = self._root_index
+        if index is None:
+            chars = self.chars
+            index = self._root_index = dict(
+                (chars[i], i) for i in xrange(self.first[0], self.first[1]))
+        return index
+
+    def automaton(self):
+        """Return the `Automaton` of the table, built on first use."""
+        automaton = self._automaton
+        if automaton is None:
+            automaton = self._automaton = Automaton(self)
+        return automaton
+
+    def find(self, word):
+        """Return the node of `word`, or -1 if it is not a known prefix."""
+        first = self.first
+        chars = self.chars
+        node = 0
+        for ch in word:
+            code = ord(ch)
+            lo = first[node]
+            hi = first[node + 1]
+            node = bisect_left(chars, code, lo, hi)
+            if node == hi or chars[node] != code:
+                return -1
+        return node
+
+    def get(self, word, default=None):
+        # find() inlined: this is the hot path of get_DAG
+        first = self.first
+        chars = self.chars
+        node = 0
+        for ch in word:
+            code = ord(ch)
+            lo = first[node]
+            hi = first[node + 1]
+            node = bisect_left(chars, code, lo, hi)
+            if node == hi or chars[node] != code:
+                return default
+        if node:
+            return self.freqs[node]
+        return default
+
+    def __contains__(self, word):
+        return self.find(word) > 0
+
+    def __getitem__(self, word):
+        node = self.find(word)
+        if node > 0:
+            return self.freqs[node]
+        raise KeyError(word)
+
+    def __len__(self):
+        return len(self.chars) - 1
+
+    def __iter__(self):
+        for word, _ in self.iteritems():
+            yield word
+
+    def iteritems(self):
+        """Yield (word, freq) for every node, prefixes included."""
+        first = self.first
+        chars = self.chars
+        freqs = self.freqs
+        prefixes = deque([''])
+        for node in xrange(len(chars)):
+            prefix = prefixes.popleft()
+            if node:
+                yield prefix, freqs[node]
+            for i in xrange(first[node], first[node + 1]):
+                prefixes.append(prefix + unichr(chars[i]))
+
+    items = iteritems
+
+    @property
+    def nbytes(self):
+        return sum(a.itemsize * len(a)
+                   for a in (self.first, self.chars, self.freqs))
+
+    def dump(self, f, total):
+        """Write the table and `total` to the binary file object `f`."""
+        f.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(self.chars), total))
+        for a in (self.first, self.chars, self.freqs):
+            f.write(a.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a file written by `dump` read-only and return (table, total).
+        Raises ValueError if the file is not a valid table for this platform.
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls.frombuffer(buf)
+        except ValueError:
+            buf.close()
+            raise
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return (table, total) viewing `buf` without copying it."""
+        if len(buf) < HEADER.size:
+            raise ValueError('truncated prefix table')
+        magic, bom, size, total = HEADER.unpack_from(buf)
+        if magic != MAGIC or bom != BYTE_ORDER_MARK:
+            raise ValueError('not a prefix table of this version/platform')
+        itemsize = array('I').itemsize
+        if len(buf) != HEADER.size + (3 * size + 1) * itemsize:
+            raise ValueError('truncated prefix table')
+        view = memoryview(buf)
+        arrays = []
+        offset = HEADER.size
+        for length in (size + 1, size, size):
+            end = offset + length * itemsize
+            arrays.append(view[offset:end].cast('I'))
+            offset = end
+        return cls(*arrays), total
+
+
+def layer(data, recent, items):
+    """
+    Return (data, recent) with the (key, value) `items` set, leaving the
+    dicts given unchanged: the items go to a copy of the small dict
+    `recent` (or None), which is merged into a copy of `data` once its
+    size squared passes the size of `data`. A run of n single changes
+    copies O(n sqrt(n)) entries instead of O(n**2) for copying `data`
+    every time.
+    """
+    recent = dict(recent) if recent else {}
+    recent.update(items)
+    if len(recent) ** 2 > len(data):
+        data = data.copy()
+        data.update(recent)
+        recent = None
+    return data, recent
+
+
+class LayeredDict(object):
+    """
+    Read-only mapping made of a dict and a small dict `recent` of the
+    entries set after it, for values replaced one entry at a time: see
+    `layer` and `with_items`.
+    """
+    __slots__ = ('data', 'recent')
+
+    def __init__(self, data=None, recent=None):
+        self.data = data if data is not None else {}
+        self.recent = recent
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def with_items(self, items):
+        """Return a LayeredDict with the (key, value) `items` set."""
+        return LayeredDict(*layer(self.data, self.recent, items))
+
+    def get(self, key, default=None):
+        if self.recent:
+            value = self.recent.get(key)
+            if value is not None:
+                return value
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.data or bool(self.recent) and key in self.recent
+
+    def __len__(self):
+        if not self.recent:
+            return len(self.data)
+        return len(self.data) + sum(
+            1 for key in self.recent if key not in self.data)
+
+    def __iter__(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    def iteritems(self):
+        recent = self.recent
+        if not recent:
+            for item in iteritems(self.data):
+                yield item
+            return
+        for key, value in iteritems(self.data):
+            yield key, recent.get(key, value)
+        for key, value in iteritems(recent):
+            if key not in self.data:
+                yield key, value
+
+    items = iteritems
+
+    def keys(self):
+        return iter(self)
+
+
+class PrefixDict(object):
+    """
+    `FREQ`-compatible mapping made of a read-only base, a `TrieTable` or a
+    plain prefix dict, and a dict overlay receiving every write
+    (`add_word`, `del_word`, ...).
+    A published dictionary is never written to: `with_words` returns a
+    new one, whose words go to a small dict `recent` until it is merged
+    into a copy of the overlay, see `layer`.
+    """
+
+    def __init__(self, base, overlay=None, recent=None):
+        self.base = base
+        self.overlay = overlay if overlay is not None else {}
+        self.recent = recent or None
+        # code points the words of the overlay start with, shared by the
+        # PrefixDicts `with_words` derives with the same overlay
+        self._starts = None
+        self._overlay_starts = None
+        self._overlay_automaton = None
+
+    def __repr__(self):
+        return '<PrefixDict base=%d overlay=%d recent=%d>' % (
+            len(self.base), len(self.overlay), len(self.recent or ()))
+
+    def with_words(self, items):
+        """Return a PrefixDict with the (word, freq) `items` set."""
+        overlay, recent = layer(self.overlay, self.recent, items)
+        result = PrefixDict(self.base, overlay, recent)
+        if overlay is self.overlay:
+            result._starts = self._starts
+        return result
+
+    def changes(self):
+        """Return a new dict of the overlay and recent words."""
+        changes = self.overlay.copy()
+        if self.recent:
+            changes.update(self.recent)
+        return changes
+
+    def get(self, word, default=None):
+        if self.recent:
+            freq = self.recent.get(word)
+            if freq is not None:
+                return freq
+        if self.overlay:
+            freq = self.overlay.get(word)
+            if freq is not None:
+                return freq
+        return self.base.get(word, default)
+
+    def overlay_lookup(self):
+        """
+        Return a function looking a word up in the overlay and recent
+        words only, None if there are none.
+        """
+        overlay = self.overlay
+        recent = self.recent
+        if not recent:
+            return overlay.get if overlay else None
+
+        def lookup(word):
+            freq = recent.get(word)
+            if freq is None:
+                freq = overlay.get(word)
+            return freq
+        return lookup
+
+    def __contains__(self, word):
+        return (word in self.overlay or word in self.base or
+                bool(self.recent) and word in self.recent)
+
+    def __getitem__(self, word):
+        freq = self.get(word)
+        if freq is None:
+            raise KeyError(word)
+        return freq
+
+    def _fold(self):
+        if self.recent:
+            self.overlay.update(self.recent)
+            self.recent = None
+        self._starts = None
+        self._overlay_starts = None
+        self._overlay_automaton = None
+
+    def __setitem__(self, word, freq):
+        self._fold()
+        self.overlay[word] = freq
+
+    def update(self, other):
+        self._fold()
+        self.overlay.update(other)
+
+    def overlay_starts(self):
+        """
+        Return the set of code points the words of the overlay and the
+        recent words start with.
+        """
+        starts = self._overlay_starts
+        if starts is None:
+            starts = self._starts
+            if starts is None:
+                starts = self._starts = set(
+                    ord(word[0]) for word in self.overlay if word)
+            if self.recent:
+                starts = starts | set(
+                    ord(word[0]) for word in self.recent if word)
+            self._overlay_starts = starts
+        return starts
+
+    def overlay_automaton(self, table):
+        """
+        Return (automaton, skip) for full mode over the overlay: the
+        `Automaton` of the overlay and recent words, and the set of the
+        nodes of `table`, the trie of the base, holding a word they replace
+        (or delete).
+        """
+        cached = self._overlay_automaton
+        if cached is None or cached[0] is not table:
+            changes = self.changes()
+            skip = set()
+            for word in changes:
+                node = table.find(word)
+                if node > 0:
+                    skip.add(node)
+            automaton = TrieTable.from_items(iteritems(changes)).automaton()
+            cached = self._overlay_automaton = (table, automaton, skip)
+        return cached[1:]
+
+    def __len__(self):
+        return len(self.base) + sum(
+            1 for word in self.changes() if word not in self.base)
+
+    def __iter__(self):
+        for word, _ in self.iteritems():
+            yield word
+
+    def iteritems(self):
+        changes = self.changes() if self.recent else self.overlay
+        for word, freq in iteritems(self.base):
+            yield word, changes.get(word, freq)
+        for word, freq in iteritems(changes):
+            if word not in self.base:
+                yield word, freq
+
+    items = iteritems
+
+    def keys(self):
+        # lets dict(FREQ) copy it like a plain dict
+        return iter(self)
+
+    @property
+    def nbytes(self):
+        changes = dict_nbytes(self.overlay) + dict_nbytes(self.recent or {})
+        if isinstance(self.base, dict):
+            return dict_nbytes(self.base) + changes
+        return self.base.nbytes + changes
+
+
+def dict_nbytes(d):
+    """Approximate deep size of a str -> int dict, keys and values included."""
+    size = sys.getsizeof(d)
+    seen = set()
+    for key, value in iteritems(d):
+        size += sys.getsizeof(key)
+        if id(value) not in seen:
+            seen.add(id(value))
+            size += sys.getsizeof(value)
+    return size
+
+
+def memory_report(dictionary=None):
+    """
+    Build both prefix dictionary representations for `dictionary` (the
+    bundled dict.txt by default) and return their sizes in bytes.
+    """
+    import jieba
+    tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT)
+    freq, total = tokenizer.gen_pfdict(tokenizer.get_dict_file())
+    table = TrieTable.from_items(iteritems(freq))
+    return {
+        'keys': len(freq),
+        'words': sum(1 for v in itervalues(freq) if v),
+        'dict_bytes': dict_nbytes(freq),
+        'compact_bytes': table.nbytes,
+    }
+
+
+def benchmark(dictionary=None, block_len=2000, blocks=20, repeat=5):
+    """
+    Build the DAG of long Han blocks, random sequences of words of
+    `dictionary` (the bundled dict.txt by default), in both
+    representations and return the best throughput of each, in
+    characters per second.
+    """
+    import jieba
+    from .bench import best_time
+    rng = random.Random(0)
+    result = {}
+    for compact in (False, True):
+        tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT,
+                                    compact=compact)
+        tokenizer.initialize()
+        if not compact:
+            words = [w for w, f in iteritems(tokenizer.FREQ) if f > 1]
+            words.sort()
+            text = []
+            for _ in xrange(blocks):
+                block = ''
+                while len(block) < block_len:
+                    block += rng.choice(words)
+                text.append(block[:block_len])
+        get_DAG_arrays = tokenizer.get_DAG_arrays
+        best, _ = best_time(
+            lambda: [get_DAG_arrays(block) for block in text], repeat)
+        result['compact' if compact else 'dict'] = (
+            block_len * blocks / max(best, 1e-9))
+    return result
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Prune and quantize a dictionary, and measure what it costs.
+
+    python -m jieba.prune [-D DICT] [-m MIN_FREQ]... [-b BITS]... [-o DIR]
+                          CORPUS
+
+Every variant drops the words less frequent than MIN_FREQ and, with BITS,
+rounds the frequencies to 2 ** BITS levels on a log scale. Single
+characters are always kept. Each variant is compared with the full
+dictionary on the lines of CORPUS:
+
+- words: words kept; keys: words and prefixes, the size of FREQ,
+- dict MB / compact MB: size of FREQ in the default and compact modes,
+- init s: time to parse the dictionary and build FREQ,
+- chars/s: accurate mode throughput,
+- F1: words cut at the same offsets as with the full dictionary,
+- same: lines cut exactly the same.
+
+Variants are written to DIR with -o, as dictionary files ready for
+`Tokenizer(dictionary)`, `jieba.set_dictionary` or ``python -m
+jieba.compile -D``.
+"""
+from __future__ import absolute_import, unicode_literals
+import os
+import sys
+import time
+import shutil
+import tempfile
+from math import exp, log
+from argparse import ArgumentParser
+import jieba
+from ._compat import *
+from .bench import best_time
+from .prefixdict import TrieTable, dict_nbytes
+
+
+def read_entries(f):
+    """
+    Yield (word, freq, tag) from a dictionary file opened in binary mode,
+    tag being None where the line has none, as `jieba.read_dict` reads it.
+    """
+    f_name = resolve_filename(f)
+    for lineno, line in enumerate(f, 1):
+        try:
+            line = line.strip().decode('utf-8')
+            if not line:
+                continue
+            fields = line.split(' ')
+            word, freq = fields[:2]
+            tag = fields[2] if len(fields) > 2 else None
+            yield word, int(freq), tag
+        except ValueError:
+            raise ValueError(
+                'invalid dictionary entry in %s at Line %s: %s' % (f_name, lineno, line))
+    f.close()
+
+
+def quantizer(max_freq, bits):
+    """
+    Return a function rounding frequencies from 1 to `max_freq` to one of
+    2 ** `bits` levels evenly spaced on a log scale. The order of the
+    frequencies is kept, ties aside.
+    """
+    step = log(max(max_freq, 2)) / ((1 << bits) - 1)
+    levels = {}
+
+    def quantize(freq):
+        if freq <= 1:
+            return freq
+        level = int(round(log(freq) / step))
+        value = levels.get(level)
+        if value is None:
+            value = levels[level] = max(int(round(exp(level * step))), 1)
+        return value
+    return quantize
+
+
+def prune_entries(entries, min_freq=1, bits=None):
+    """
+    Return the (word, freq, tag) `entries` with a frequency of at least
+    `min_freq`, single characters always included, with the frequencies
+    quantized to `bits` bits if given.
+    """
+    entries = [(word, freq, tag) for word, freq, tag in entries
+               if freq >= min_freq or len(word) == 1]
+    if bits:
+        quantize = quantizer(max(freq for _, freq, _ in entries), bits)
+        entries = [(word, quantize(freq), tag) for word, freq, tag in entries]
+    return entries
+
+
+def write_entries(path, entries):
+    """Write (word, freq, tag) entries as a dictionary file."""
+    with open(path, 'wb') as f:
+        for word, freq, tag in entries:
+            if tag:
+                line = '%s %d %s\n' % (word, freq, tag)
+            else:
+                line = '%s %d\n' % (word, freq)
+            f.write(line.encode('utf-8'))
+
+
+def variant_name(min_freq, bits):
+    return 'min%d' % min_freq + ('.q%d' % bits if bits else '')
+
+
+def measure(path, corpus, reference=None, HMM=True, repeat=3):
+    """
+    Load the dictionary file `path` and cut the lines of `corpus` with it,
+    keeping the best throughput of `repeat` runs.
+    Returns a dict of statistics and the word offsets of every line;
+    `reference`, the offsets returned for the full dictionary, adds the
+    agreement with it.
+    """
+    tokenizer = jieba.Tokenizer(path)
+    t = time.time()
+    with open(path, 'rb') as f:
+        FREQ, total = tokenizer.gen_pfdict(f)
+    init = time.time() - t
+    stats = {
+        'words': sum(1 for freq in itervalues(FREQ) if freq),
+        'keys': len(FREQ),
+        'dict_bytes': dict_nbytes(FREQ),
+        'compact_bytes': TrieTable.from_items(iteritems(FREQ)).nbytes,
+        'init': init,
+    }
+    tokenizer.replace_dict(FREQ, total)
+    tokenizer.initialized = True
+    best, offsets = best_time(
+        lambda: [tokenizer.cut_offsets(line, HMM=HMM) for line in corpus],
+        repeat)
+    stats['chars_per_sec'] = sum(len(line) for line in corpus) / max(
+        best, 1e-9)
+    if reference is not None:
+        common = found = expected = same = 0
+        for words, ref in zip(offsets, reference):
+            words = set(zip(words[::2], words[1::2]))
+            ref = set(zip(ref[::2], ref[1::2]))
+            common += len(words & ref)
+            found += len(words)
+            expected += len(ref)
+            same += words == ref
+        stats['f1'] = 2.0 * common / max(found + expected, 1)
+        stats['same'] = float(same) / max(len(reference), 1)
+    return stats, offsets
+
+
+def report(corpus, dictionary=None, min_freqs=(2, 5, 10, 50),
+           bits=(None,), output_dir=None, HMM=True, repeat=3):
+    """
+    Build the variants of `dictionary` (the bundled dict.txt by default)
+    for every combination of `min_freqs` and `bits`, and measure them and
+    the full dictionary on `corpus`, a sequence of lines.
+    Returns a list of (name, stats), the full dictionary first.
+    """
+    corpus = [strdecode(line).rstrip('\r\n') for line in corpus]
+    tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT)
+    entries = list(read_entries(tokenizer.get_dict_file()))
+    tmp_dir = None
+    if output_dir is None:
+        output_dir = tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(output_dir, 'full.txt')
+        write_entries(path, entries)
+        stats, reference = measure(path, corpus, HMM=HMM, repeat=repeat)
+        stats['f1'] = stats['same'] = 1.0
+        results = [('full', stats)]
+        for min_freq in min_freqs:
+            for b in bits:
+                name = variant_name(min_freq, b)
+                path = os.path.join(output_dir, name + '.txt')
+                write_entries(path, prune_entries(entries, min_freq, b))
+                stats, _ = measure(path, corpus, reference, HMM, repeat)
+                results.append((name, stats))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    return results
+
+
+def format_report(results):
+    """Format the result of `report` as a table."""
+    lines = ['%-12s %8s %8s %8s %10s %7s %10s %7s %7s' % (
+        'variant', 'words', 'keys', 'dict MB', 'compact MB', 'init s',
+        'chars/s', 'F1', 'same')]
+    for name, s in results:
+        lines.append('%-12s %8d %8d %8.1f %10.1f %7.2f %10.0f %7.4f %7.4f' % (
+            name, s['words'], s['keys'], s['dict_bytes'] / 1048576.0,
+            s['compact_bytes'] / 1048576.0, s['init'], s['chars_per_sec'],
+            s['f1'], s['same']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(
+        usage="%s -m jieba.prune [options] corpus" % sys.executable,
+        description="Build pruned and quantized variants of a dictionary "
+                    "and compare them with the full one on a corpus.")
+    parser.add_argument("-D", "--dict",
+                        help="use DICT instead of the default dictionary")
+    parser.add_argument("-m", "--min-freq", type=int, action="append",
+                        help="drop the words less frequent than MIN_FREQ; "
+                             "may be repeated (default: 2 5 10 50)")
+    parser.add_argument("-b", "--bits", type=int, action="append",
+                        help="also quantize the frequencies to BITS bits; "
+                             "may be repeated")
+    parser.add_argument("-o", "--output-dir",
+                        help="keep the variants in OUTPUT_DIR")
+    parser.add_argument("-n", "--no-hmm", dest="hmm", action="store_false",
+                        default=True, help="don't use the Hidden Markov Model")
+    parser.add_argument("corpus", help="reference corpus, one text per line")
+    args = parser.parse_args()
+
+    jieba.setLogLevel(60)
+    bits = [None] + (args.bits or [])
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    with open(args.corpus, 'rb') as f:
+        corpus = [line.decode('utf-8') for line in f]
+    results = report(corpus, args.dict, args.min_freq or (2, 5, 10, 50),
+                     bits, args.output_dir, args.hmm)
+    print(format_report(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Block scanner shared by jieba, jieba.posseg and jieba.finalseg.
+
+Segmentation starts by splitting the text into blocks the dictionary or
+the HMM can cut, and the text in between, which is passed through by
+simple rules. Instead of splitting with one regular expression and
+matching every piece again with another, a `BlockScanner` joins its
+rules into a single pattern, built from the code point ranges below, and
+tells which rule matched each span from `match.lastindex`, so every
+character is classified once.
+
+`benchmark()` measures the throughput of the scanners on mixed text.
+"""
+from __future__ import absolute_import, unicode_literals
+import re
+from ._compat import *
+
+# code point ranges (first, last) of the character classes
+HAN = ((0x4E00, 0x9FD5),)
+ALNUM = ((0x30, 0x39), (0x41, 0x5A), (0x61, 0x7A))
+# '#', '&', '+', '.' and '_' do not end a block ("C++", "AT&T", "3.14")
+WORD_SYMBOLS = ((0x23, 0x23), (0x26, 0x26), (0x2B, 0x2B), (0x2E, 0x2E),
+                (0x5F, 0x5F))
+DOT = ((0x2E, 0x2E),)
+DIGITS = ((0x30, 0x39),)
+# '+', '#' and newlines are kept inside words in full mode
+FULL_MODE_SYMBOLS = ((0x0A, 0x0A), (0x23, 0x23), (0x2B, 0x2B))
+
+# span kinds
+BLOCK = 'block'  # to be cut with the dictionary or the HMM
+SKIP = 'skip'    # one word
+CHAR = 'char'    # one word per character
+SEP = 'sep'      # a separator dropped in full mode
+
+
+def char_class(ranges, negate=False, extra=''):
+    """
+    Return a regular expression character class matching `ranges`, and
+    the class escapes in `extra` (like r'\\d').
+    """
+    parts = []
+    for first, last in sorted(ranges):
+        if first == last:
+            parts.append(re.escape(unichr(first)))
+        else:
+            parts.append('%s-%s' % (re.escape(unichr(first)),
+                                    re.escape(unichr(last))))
+    return '[%s%s%s]' % ('^' if negate else '', ''.join(parts), extra)
+
+
+class BlockScanner(object):
+    """
+    Split text into typed spans in one pass.
+    Parameter:
+        - rules: (kind, pattern) pairs, tried in order at each position.
+                 Patterns must not contain capturing groups. Text no rule
+                 matches is left out, so the last rule is usually a
+                 catch-all.
+    """
+
+    def __init__(self, rules):
+        # index 0 is never used: lastindex starts at 1
+        self.kinds = (None,) + tuple(kind for kind, _ in rules)
+        self.regex = re.compile(
+            '|'.join('(%s)' % pattern for _, pattern in rules), re.U | re.S)
+        # for hot loops: kinds[m.lastindex] is the kind of match m
+        self.finditer = self.regex.finditer
+
+    def __repr__(self):
+        return '<BlockScanner kinds=%r>' % (self.kinds[1:],)
+
+    def scan(self, text):
+        """Yield (kind, start, end) for each span of `text`."""
+        kinds = self.kinds
+        for m in self.regex.finditer(text):
+            yield kinds[m.lastindex], m.start(), m.end()
+
+
+# Tokenizer.cut (accurate mode) and POSTokenizer.cut
+DEFAULT = BlockScanner([
+    (BLOCK, char_class(HAN + ALNUM + WORD_SYMBOLS) + '+'),
+    (SKIP, r'\r\n|\s'),
+    (CHAR, '.'),
+])
+
+# Tokenizer.cut in full mode: text between Han blocks is split at
+# separators, which are dropped
+CUT_ALL = BlockScanner([
+    (BLOCK, char_class(HAN) + '+'),
+    (SKIP, char_class(ALNUM + FULL_MODE_SYMBOLS) + '+'),
+    (SEP, '.'),
+])
+
+# finalseg.cut: numbers and latin words are kept whole, and so is the
+# text between them, which takes the digits of other scripts (\d matches
+# them too) unless a number starts there
+FINALSEG = BlockScanner([
+    (BLOCK, char_class(HAN) + '+'),
+    (SKIP, r'\d+\.\d+|[a-zA-Z0-9]+'),
+    (SKIP, r'(?:%s+|(?![0-9]|\d+\.\d)\d)+' % char_class(
+        HAN + ALNUM, negate=True, extra=r'\d')),
+])
+
+# POSTokenizer, for the text the HMM tags: kinds are the POS tags
+DETAIL = BlockScanner([
+    (BLOCK, char_class(HAN) + '+'),
+    ('m', char_class(DOT + DIGITS) + '+'),
+    ('eng', char_class(ALNUM) + '+'),
+    ('x', char_class(HAN + ALNUM + DOT, negate=True) + '+'),
+])
+
+SAMPLE = ("2016年3月，AlphaGo以4:1战胜李世石。Python 3.6 的 f-string "
+          "和 C++ 的 std::string 都很常用；价格是 12.5 元 (约 $1.8)。\r\n"
+          "我来到北京清华大学，He said \"hello world\" 在 AT&T 工作。\n")
+
+
+def benchmark(text=None, repeat=5):
+    """
+    Scan `text` (mixed Chinese, English and numbers by default) with every
+    scanner and return the best throughput of each, in characters per
+    second.
+    """
+    from .bench import best_time
+    if text is None:
+        text = SAMPLE * 2000
+    result = {}
+    for name, scanner in (('DEFAULT', DEFAULT), ('CUT_ALL', CUT_ALL),
+                          ('FINALSEG', FINALSEG), ('DETAIL', DETAIL)):
+        finditer = scanner.finditer
+        best, _ = best_time(
+            lambda: [m.lastindex for m in finditer(text)], repeat)
+        result[name] = len(text) / max(best, 1e-9)
+    return result
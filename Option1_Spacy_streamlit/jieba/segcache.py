@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Caches of segmentation results.
+"""
+from __future__ import absolute_import, unicode_literals
+import os
+import time
+import hashlib
+import threading
+from array import array
+from collections import namedtuple, OrderedDict
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class BlockCache(object):
+    """
+    Bounded LRU mapping, used by `Tokenizer.enable_block_cache` to remember
+    the word offsets of Han blocks.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def __repr__(self):
+        return '<BlockCache %r>' % (self.info(),)
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.pop(key, None)
+            if value is None:
+                self.misses += 1
+            else:
+                self.data[key] = value
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.data))
+
+
+class ResultCache(object):
+    """
+    Persistent cache of the offsets of whole texts in an sqlite database,
+    used by `Tokenizer.enable_result_cache`. Results are keyed by the
+    sha1 of the text, the cut mode, HMM and the content key of the
+    dictionary, so a changed dictionary never gets stale results. Once
+    they take more than `max_bytes`, the least recently used are evicted.
+    The database can be shared by threads and processes.
+    Parameter:
+        - path: The database file, created if missing.
+        - max_bytes: Approximate size limit of the stored offsets.
+        - min_chars: Shorter texts are cut again rather than looked up.
+    """
+    # bumped when the stored offsets change meaning; older databases are
+    # emptied
+    FORMAT = 1
+    # the use time of an entry is refreshed at most this often (seconds),
+    # to spare a write on most hits
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, max_bytes=64 << 20, min_chars=256):
+        if sqlite3 is None:
+            raise ImportError("jieba: the result cache needs sqlite3")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_chars = min_chars
+        self.hits = 0
+        self.misses = 0
+        # bytes added since the size was last checked
+        self.added = 0
+        self.lock = threading.Lock()
+        self.pid = None
+        with self.lock:
+            db = self._connect()
+            if db.execute('PRAGMA user_version').fetchone()[0] != self.FORMAT:
+                db.execute('DROP TABLE IF EXISTS results')
+                db.execute('PRAGMA user_version = %d' % self.FORMAT)
+            db.execute('CREATE TABLE IF NOT EXISTS results ('
+                       'digest BLOB, mode TEXT, hmm INTEGER, dict_key TEXT, '
+                       'spans BLOB NOT NULL, size INTEGER NOT NULL, '
+                       'used REAL NOT NULL, '
+                       'PRIMARY KEY (digest, mode, hmm, dict_key))')
+            db.execute('CREATE INDEX IF NOT EXISTS results_used '
+                       'ON results (used)')
+
+    def __repr__(self):
+        return '<ResultCache %r>' % self.path
+
+    def _connect(self):
+        """
+        Return the connection of this process: a connection inherited
+        through fork must not be used, the child opens its own.
+        """
+        if self.pid != os.getpid():
+            self.db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            self.pid = os.getpid()
+        return self.db
+
+    @staticmethod
+    def digest(text):
+        return sqlite3.Binary(hashlib.sha1(text.encode('utf-8')).digest())
+
+    def get(self, text, mode, HMM, dict_key):
+        """Return the offsets stored for `text`, or None."""
+        key = (self.digest(text), mode, int(HMM), dict_key)
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT rowid, spans, used FROM results WHERE digest = ? '
+                'AND mode = ? AND hmm = ? AND dict_key = ?', key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            rowid, spans, used = row
+            now = time.time()
+            if now - used > self.TOUCH_INTERVAL:
+                self.db.execute(
+                    'UPDATE results SET used = ? WHERE rowid = ?',
+                    (now, rowid))
+        return array('i', bytes(spans))
+
+    def put(self, text, mode, HMM, dict_key, spans):
+        """Store the offsets `spans` (an array('i')) of `text`."""
+        data = spans.tobytes()
+        with self.lock:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO results '
+                '(digest, mode, hmm, dict_key, spans, size, used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.digest(text), mode, int(HMM), dict_key,
+                 sqlite3.Binary(data), len(data), time.time()))
+            self.added += len(data)
+            # other processes write too: the total is checked in the
+            # database every max_bytes / 16 added here
+            if self.added > self.max_bytes >> 4:
+                self.added = 0
+                self._evict()
+
+    def _evict(self):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            size = db.execute(
+                'SELECT TOTAL(size) FROM results').fetchone()[0]
+            if size > self.max_bytes:
+                # evict down to 90% so that the next check is not at once
+                excess = size - self.max_bytes * 0.9
+                rowids = []
+                for rowid, n in db.execute(
+                        'SELECT rowid, size FROM results ORDER BY used'):
+                    rowids.append((rowid,))
+                    excess -= n
+                    if excess <= 0:
+                        break
+                db.executemany('DELETE FROM results WHERE rowid = ?', rowids)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def clear(self):
+        with self.lock:
+            self._connect().execute('DELETE FROM results')
+
+    def close(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                self.db.close()
+
+    def info(self):
+        """Return (hits, misses, max_bytes, bytes stored)."""
+        with self.lock:
+            size = self._connect().execute(
+                'SELECT TOTAL(size) FROM results').fetchone()[0]
+        return CacheInfo(self.hits, self.misses, self.max_bytes, int(size))
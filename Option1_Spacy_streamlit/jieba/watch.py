@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Reload user dictionaries when their files change.
+
+    watcher = UserDictWatcher(['userdict_tw.txt'])
+    watcher.start()
+
+A `UserDictWatcher` polls the files it watches and, when one changes,
+rebuilds the dictionary the tokenizer had when the watcher started plus
+the current content of every file, so words deleted from a file are gone
+after the reload. The new dictionary is built in the watcher thread and
+published with `Tokenizer.replace_dict`, a single swap of the tokenizer
+state: calls in progress finish with the dictionary they started with and
+the following calls get all the changes at once. The user POS tags are
+part of that state, so `POSTokenizer` instances sharing the tokenizer
+(like `jieba.posseg.dt` for `jieba.dt`) switch at the same time. The
+workers of a `jieba.parallel.ParallelTokenizer` (or `enable_parallel`)
+are restarted by its next call.
+"""
+from __future__ import absolute_import, unicode_literals
+import os
+import threading
+import jieba
+from ._compat import *
+
+default_logger = jieba.default_logger
+
+
+def _stamp(path):
+    """Return what tells whether the file `path` changed, or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+class UserDictWatcher(object):
+    """
+    Keep the user dictionaries `paths` of `tokenizer` up to date.
+    Parameter:
+        - paths: Paths of user dictionaries, in the format of
+                 `Tokenizer.load_userdict`; more can be added with `add`.
+        - tokenizer: A Tokenizer or POSTokenizer, `jieba.dt` by default.
+        - interval: Seconds between two checks of the files by the thread
+                    `start` runs.
+
+    Words added to the tokenizer by other means after the first load are
+    dropped by the next reload: add them before, or to a watched file.
+    """
+
+    def __init__(self, paths=(), tokenizer=None, interval=2.0):
+        if tokenizer is None:
+            tokenizer = jieba.dt
+        # a POSTokenizer looks its user tags up in its tokenizer
+        self.tokenizer = getattr(tokenizer, 'tokenizer', tokenizer)
+        self.interval = interval
+        self.paths = []
+        self.stamps = {}
+        # (DictState, dict_key) of the tokenizer before the first load
+        self.base = None
+        # version of the dictionary published by the last reload
+        self.version = None
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        for path in paths:
+            self.add(path)
+
+    def __repr__(self):
+        return '<UserDictWatcher %r>' % (self.paths,)
+
+    def add(self, path):
+        """Watch `path` too; it is loaded by the next `check`."""
+        path = os.path.abspath(path)
+        with self.lock:
+            if path not in self.paths:
+                self.paths.append(path)
+                self.stamps[path] = False
+
+    def changed(self):
+        """Tell whether a watched file changed since it was last loaded."""
+        return any(_stamp(path) != self.stamps.get(path)
+                   for path in self.paths)
+
+    def check(self):
+        """
+        Reload the dictionaries if a watched file changed. Returns True if
+        a new dictionary was published.
+        """
+        if self.changed():
+            return self.reload()
+        return False
+
+    def reload(self):
+        """
+        Rebuild the dictionary from the current content of the watched
+        files and swap it in. Returns True on success; on failure the error
+        is logged and the tokenizer keeps its dictionary.
+        """
+        tokenizer = self.tokenizer
+        with self.lock:
+            if self.base is None:
+                tokenizer.check_initialized()
+                with tokenizer.lock:
+                    self.base = tokenizer.state, tokenizer.dict_key
+            elif tokenizer.state.version != self.version:
+                default_logger.warning(
+                    "Dictionary changed since the last reload of %s, "
+                    "the changes are dropped." % ', '.join(self.paths))
+            sources = []
+            for path in self.paths:
+                # stamped before reading: a write in between is picked up
+                # by the next check
+                self.stamps[path] = _stamp(path)
+                try:
+                    sources.append(jieba._read_userdict_source(path))
+                except (IOError, OSError) as e:
+                    default_logger.warning(
+                        "Skipping user dict %s: %s" % (path, e))
+            state, dict_key = self.base
+            try:
+                # the first load may come from the user dict cache; every
+                # edit would add one more file there
+                draft, dict_key = tokenizer._apply_userdicts(
+                    state, dict_key, sources, cache=self.version is None)
+            except Exception:
+                default_logger.exception(
+                    "Reloading user dicts failed, keeping the current "
+                    "dictionary.")
+                return False
+            with tokenizer.lock:
+                tokenizer.replace_dict(
+                    draft.freq, draft.total, dict_key, draft.tags)
+                self.version = tokenizer.state.version
+            default_logger.debug("Reloaded user dicts %s" % ', '.join(
+                f_name for f_name, _, _ in sources))
+            return True
+
+    def start(self):
+        """
+        Load the watched files now, then check them every `interval`
+        seconds in a daemon thread until `stop` is called.
+        """
+        if self._thread is not None:
+            return
+        self.check()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='jieba-userdict-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread started by `start`."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                default_logger.exception("Checking user dicts failed.")
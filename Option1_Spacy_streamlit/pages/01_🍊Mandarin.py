@@ -51,8 +51,21 @@ class JiebaTokenizer:
         self.vocab = vocab
 
     def __call__(self, text):
-        words = jieba.cut(text) # returns a generator
-        tokens = list(words) # convert the genetator to a list
+        return self._make_doc(text, jieba.cut_offsets(text)) # flat (start, end) offsets
+
+    def recut(self, text):
+        # for the text area only: re-cut what changed since this session's
+        # previous text
+        previous = st.session_state.get("jieba_previous")
+        if previous is None:
+            spans = jieba.cut_offsets(text)
+        else:
+            spans = jieba.recut(previous[0], previous[1], text)
+        st.session_state["jieba_previous"] = (text, spans)
+        return self._make_doc(text, spans)
+
+    def _make_doc(self, text, spans):
+        tokens = [text[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)]
         spaces = [False] * len(tokens)
         doc = Doc(self.vocab, words=tokens, spaces=spaces)
         return doc
@@ -119,6 +132,9 @@ st.set_page_config(
 )
 st.markdown(f"# {DESCRIPTION}") 
 
+# Load jieba's dictionary while spaCy loads
+jieba.initialize_in_background()
+
 # Load the model
 nlp = spacy.load(MODEL_NAME)
           
@@ -130,12 +146,21 @@ nlp = spacy.load(MODEL_NAME)
 selected_tokenizer = st.radio("請選擇斷詞模型", ["jieba-TW", "spaCy"])
 if selected_tokenizer == "jieba-TW":
     nlp.tokenizer = JiebaTokenizer(nlp.vocab)
+    # jieba outlives script reruns, so widget changes reuse cached blocks
+    if jieba.dt.block_cache is None:
+        jieba.dt.enable_block_cache(4096)
+    # and texts cut before, like DEFAULT_TEXT, are read back across restarts
+    if jieba.dt.result_cache is None:
+        jieba.dt.enable_result_cache(min_chars=64)
 
 # Page starts from here
 st.markdown("## 待分析文本")     
 st.info("請在下面的文字框輸入文本並按下Ctrl + Enter以更新分析結果")
 text = st.text_area("",  DEFAULT_TEXT, height=200)
-doc = nlp(text)
+if isinstance(nlp.tokenizer, JiebaTokenizer):
+    doc = nlp(nlp.tokenizer.recut(text))
+else:
+    doc = nlp(text)
 st.markdown("---")
 
 st.info("請勾選以下至少一項功能")